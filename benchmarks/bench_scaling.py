@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+"""
+Measure how doco2podans scales, stage by stage, on the samples and on
+synthetic Docker Compose files of growing size, and write the results as
+JSON which can be compared with the results of another commit
+"""
+import argparse
+import functools
+import glob
+import json
+import os
+import platform
+import shlex
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import doco2podans  # noqa: E402
+import synthetic  # noqa: E402
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+# the functions of doco2podans timed as stages, in the order they are called
+STAGES = (
+    'read_doco_from_file',
+    'recurse_replace_envvars',
+    'parse_project',
+    'extract_secret_tasks',
+    'extract_network_tasks',
+    'extract_volume_tasks',
+    'extract_container_tasks',
+    'create_kube_tasks',
+    'create_quadlet_tasks',
+    'create_teardown_tasks',
+    'generate_from_template',
+)
+
+THRESHOLD = 0.2  # relative slow down considered as regression
+
+
+def timed(name, function, timings):
+    """
+    Wrap the function so that its duration is added to the timings under
+    the given name, only counting the outermost call of recursive functions
+    """
+    depth = 0
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        nonlocal depth
+        if depth:
+            return function(*args, **kwargs)
+        depth += 1
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            timings[name] = (timings.get(name, 0)
+                             + time.perf_counter() - start)
+            depth -= 1
+
+    return wrapper
+
+
+def convert(content, path, argv):
+    """
+    Convert the content of the docker compose file at path like dc2pa.py
+    would do, without cache, and return the converted text
+    """
+    args = doco2podans.parse_arguments(['--no-cache'] + argv + [path])
+    args.doco.close()
+    return doco2podans.convert_doco(content, args)
+
+
+def bench_file(path, argv, repeat):
+    """
+    Benchmark the conversion of one docker compose file
+
+    Return a dictionary with the number of services, the best duration of
+    each stage and of the whole conversion in milliseconds, and the peak
+    memory allocated in KiB
+    """
+    with open(path) as infile:
+        content = infile.read()
+    doco = yaml.load(content, Loader=doco2podans.YAML_LOADER)
+    best = None
+    for _ in range(repeat):
+        timings = {}
+        originals = {x: getattr(doco2podans, x) for x in STAGES}
+        for name, function in originals.items():
+            setattr(doco2podans, name, timed(name, function, timings))
+        start = time.perf_counter()
+        try:
+            convert(content, path, argv)
+        finally:
+            total = time.perf_counter() - start
+            for name, function in originals.items():
+                setattr(doco2podans, name, function)
+        if best is None or total < best[0]:
+            best = (total, timings)
+    tracemalloc.start()
+    try:
+        convert(content, path, argv)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {
+        'services': len(doco.get('services') or {}),
+        'total': round(best[0] * 1000, 3),
+        'stages': {x: round(best[1][x] * 1000, 3)
+                   for x in STAGES if x in best[1]},
+        'peak_memory': peak // 1024,
+    }
+
+
+def get_commit():
+    """
+    Return the current git commit of the repository, or None
+    """
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, check=True,
+            capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, reference):
+    """
+    Print the relative duration of each file compared to the reference
+    results
+
+    Return the number of files slower than the reference by more than the
+    threshold
+    """
+    regressions = 0
+    print('{:40} {:>10} {:>10} {:>7}'.format(
+        'file (durations in ms)', 'reference', 'current', 'ratio'))
+    for name, result in results['files'].items():
+        if name not in reference['files']:
+            continue
+        before = reference['files'][name]['total']
+        ratio = result['total'] / before if before else 1
+        flag = ''
+        if ratio > 1 + THRESHOLD:
+            flag = ' REGRESSION'
+            regressions += 1
+        print('{:40} {:10.2f} {:10.2f} {:7.2f}{}'.format(
+            name[-40:], before, result['total'], ratio, flag))
+    return regressions
+
+
+def parse_arguments():
+    """
+    Parse arguments from sys.argv
+
+    Returns the parsed arguments
+    """
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--sizes', default='10,100,1000',
+                        help='comma separated numbers of services of the '
+                        'synthetic files')
+    parser.add_argument('--links', type=float, default=0.1,
+                        help='ratio of services with a link')
+    parser.add_argument('--depends', type=float, default=0.3,
+                        help='ratio of services with dependencies')
+    parser.add_argument('--volumes', type=float, default=0.5,
+                        help='ratio of services with a volume')
+    parser.add_argument('--envvars', type=int, default=5,
+                        help='number of environment variables per service')
+    parser.add_argument('--secrets', type=float, default=0.1,
+                        help='ratio of services with a secret')
+    parser.add_argument('--no-samples', dest='samples', action='store_false',
+                        help="don't measure the samples")
+    parser.add_argument('--options', default='',
+                        help='options given to doco2podans, e.g. '
+                        '"--kind kube"')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='number of repetitions of each conversion')
+    parser.add_argument('--output', type=argparse.FileType('w'),
+                        help='JSON file where to write the results')
+    parser.add_argument('--compare', type=argparse.FileType('r'),
+                        help='JSON results of a previous run to compare '
+                        'with, exiting with 1 in case of regression')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    argv = shlex.split(args.options)
+    os.chdir(ROOT)  # relative paths in the samples
+    paths = []
+    if args.samples:
+        paths += sorted(glob.glob(os.path.join('samples', '**', '*.yml'),
+                                  recursive=True))
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for size in (int(x) for x in args.sizes.split(',') if x):
+            path = os.path.join(tmpdir, 'synthetic-{}.yml'.format(size))
+            with open(path, 'w') as outfile:
+                yaml.safe_dump(synthetic.generate_doco(
+                    size, args.links, args.depends, args.volumes,
+                    args.envvars, args.secrets), outfile, sort_keys=False)
+            paths.append(path)
+        results = {
+            'commit': get_commit(),
+            'version': doco2podans.VERSION,
+            'python': platform.python_version(),
+            'libyaml': doco2podans.YAML_LOADER is not yaml.SafeLoader,
+            'options': argv,
+            'files': {},
+        }
+        print('{:40} {:>8} {:>10} {:>10}  {}'.format(
+            'file (durations in ms)', 'services', 'total', 'peak KiB',
+            'slowest stage'))
+        for path in paths:
+            name = (os.path.basename(path) if path.startswith(tmpdir)
+                    else os.path.relpath(path))
+            result = bench_file(path, argv, args.repeat)
+            results['files'][name] = result
+            slowest = max(result['stages'], key=result['stages'].get)
+            print('{:40} {:8} {:10.2f} {:10}  {} ({:.2f})'.format(
+                name[-40:], result['services'], result['total'],
+                result['peak_memory'], slowest, result['stages'][slowest]))
+    if args.output:
+        json.dump(results, args.output, indent=2)
+        args.output.write('\n')
+    if args.compare:
+        print()
+        sys.exit(1 if compare(results, json.load(args.compare)) else 0)
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+"""
+Compare the pure Python and the libyaml based YAML loading and dumping of
+doco2podans, on the samples and on a synthetic Docker Compose file, and
+check that both produce byte-identical playbooks
+"""
+import argparse
+import glob
+import os
+import sys
+import timeit
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import doco2podans  # noqa: E402
+import synthetic  # noqa: E402
+
+SAMPLES = os.path.join(os.path.dirname(__file__), os.pardir, 'samples')
+
+
+def bench(function, repeat):
+    """
+    Return the best duration in milliseconds of the function
+    """
+    return min(timeit.repeat(function, number=1, repeat=repeat)) * 1000
+
+
+def render(tasks, dumper):
+    """
+    Render the tasks as playbook with the given YAML dumper
+    """
+    doco2podans.YAML_DUMPER = dumper
+    return doco2podans.generate_from_template(tasks)
+
+
+def bench_file(path, repeat):
+    """
+    Benchmark loading, converting and rendering one Docker Compose file
+
+    Return the load and render durations with both implementations, and
+    whether the rendered playbooks are identical
+    """
+    with open(path) as infile:
+        content = infile.read()
+    args = doco2podans.parse_arguments(['--no-cache', path])
+    tasks = doco2podans.doco2podans(
+        doco2podans.read_doco_from_file(content), args)
+    args.doco.close()
+    result = {
+        'load_py': bench(lambda: yaml.load(content, Loader=yaml.SafeLoader),
+                         repeat),
+        'load_c': bench(lambda: yaml.load(content, Loader=yaml.CSafeLoader),
+                        repeat),
+        'render_py': bench(lambda: render(tasks, yaml.SafeDumper), repeat),
+        'render_c': bench(lambda: render(tasks, yaml.CSafeDumper), repeat),
+        'identical': (render(tasks, yaml.SafeDumper)
+                      == render(tasks, yaml.CSafeDumper)),
+    }
+    return result
+
+
+def parse_arguments():
+    """
+    Parse arguments from sys.argv
+
+    Returns the parsed arguments
+    """
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='number of repetitions of each measure')
+    parser.add_argument('--services', type=int, default=2000,
+                        help='number of services of the synthetic file')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    if not yaml.__with_libyaml__:
+        sys.exit('ERROR: PyYAML has been built without libyaml')
+    os.chdir(os.path.join(os.path.dirname(__file__), os.pardir))
+    paths = sorted(glob.glob(os.path.join('samples', '**', '*.yml'),
+                             recursive=True))
+    synthetic_path = os.path.join(
+        os.environ.get('TMPDIR', '/tmp'),
+        'synthetic-{}.yml'.format(args.services))
+    with open(synthetic_path, 'w') as outfile:
+        yaml.safe_dump(synthetic.generate_doco(args.services), outfile,
+                       sort_keys=False)
+    paths.append(synthetic_path)
+    print('{:50} {:>9} {:>9} {:>9} {:>9} {:>9}'.format(
+        'file (durations in ms)', 'load py', 'load c', 'render py',
+        'render c', 'identical'))
+    all_identical = True
+    for path in paths:
+        result = bench_file(path, args.repeat)
+        all_identical &= result['identical']
+        print('{:50} {load_py:9.2f} {load_c:9.2f} {render_py:9.2f} '
+              '{render_c:9.2f} {identical!s:>9}'.format(
+                  os.path.basename(path)[-50:], **result))
+    sys.exit(0 if all_identical else 1)
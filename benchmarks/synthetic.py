@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+"""
+Generate synthetic Docker Compose files of any size, to measure how
+doco2podans scales
+"""
+import argparse
+import random
+import sys
+import yaml
+
+
+def generate_doco(services=100, links=0.1, depends=0.3, volumes=0.5,
+                  envvars=5, secrets=0.1, seed=0):
+    """
+    Generate a Docker Compose structure
+
+    services is the number of services, links, depends, volumes and secrets
+    the ratio of services with resp. a link, dependencies, a volume and
+    a secret, and envvars the number of environment variables per service.
+    Returns the Docker Compose structure
+    """
+    rand = random.Random(seed)
+    doco = {'services': {}}
+    for idx in range(services):
+        name = 'service{}'.format(idx)
+        service = {
+            'image': 'image{}:latest'.format(idx % 50),
+            'restart': 'always',
+            'ports': ['{}:80'.format(10000 + idx)],
+        }
+        if envvars:
+            service['environment'] = {
+                'VAR_{}'.format(x): '${{VALUE_{}}}'.format(x)
+                for x in range(envvars)}
+        if idx and rand.random() < links:
+            service['links'] = ['service{}'.format(rand.randrange(idx))]
+        if idx and rand.random() < depends:
+            service['depends_on'] = sorted({
+                'service{}'.format(rand.randrange(idx))
+                for x in range(rand.randint(1, 3))})
+        if rand.random() < volumes:
+            volume = 'volume{}'.format(idx)
+            doco.setdefault('volumes', {})[volume] = {}
+            service['volumes'] = [volume + ':/data']
+        if rand.random() < secrets:
+            secret = 'secret{}'.format(idx)
+            doco.setdefault('secrets', {})[secret] = {
+                'file': './secrets/{}.txt'.format(secret)}
+            service['secrets'] = [secret]
+        doco['services'][name] = service
+    return doco
+
+
+def parse_arguments():
+    """
+    Parse arguments from sys.argv
+
+    Returns the parsed arguments
+    """
+    parser = argparse.ArgumentParser(
+        description="Generate a synthetic Docker Compose file")
+    parser.add_argument('--services', type=int, default=100,
+                        help='number of services')
+    parser.add_argument('--links', type=float, default=0.1,
+                        help='ratio of services with a link')
+    parser.add_argument('--depends', type=float, default=0.3,
+                        help='ratio of services with dependencies')
+    parser.add_argument('--volumes', type=float, default=0.5,
+                        help='ratio of services with a volume')
+    parser.add_argument('--envvars', type=int, default=5,
+                        help='number of environment variables per service')
+    parser.add_argument('--secrets', type=float, default=0.1,
+                        help='ratio of services with a secret')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the random generator')
+    parser.add_argument('doco', type=argparse.FileType('w'),
+                        default=sys.stdout, nargs='?',
+                        help='a target docker compose file')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    doco = generate_doco(args.services, args.links, args.depends,
+                         args.volumes, args.envvars, args.secrets, args.seed)
+    yaml.safe_dump(doco, args.doco, sort_keys=False)
@@ -0,0 +1,3120 @@
+"""
+Translate Docker Compose to Podman Ansible, the implementation of dc2pa.py
+"""
+import argparse
+import collections
+import contextlib
+import dataclasses
+import io
+import json
+import os
+import re
+import shlex
+import sys
+import time
+import yaml
+
+VERSION = '0.1.0'
+
+# the libyaml based loader and dumper are much faster, if available
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+YAML_DUMPER = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
+# names of podman ansible modules
+
+ANSMOD = {
+    'container': 'containers.podman.podman_container',
+    'image': 'containers.podman.podman_image',
+    'containers': 'containers.podman.podman_containers',
+    'network': 'containers.podman.podman_network',
+    'play': 'containers.podman.podman_play',
+    'pod': 'containers.podman.podman_pod',
+    'secret': 'containers.podman.podman_secret',
+    'volume': 'containers.podman.podman_volume',
+}
+
+VOLUME_SAME = {}
+NETWORK_SAME = {}
+CONTAINER_SAME = {
+    'ports': 'ports',
+    'image': 'image',
+    'command': 'command',
+    'hostname': 'hostname',
+    'volumes': 'volumes',
+    'volumes_from': 'volumes_from',
+    'restart': 'restart_policy',
+    'secrets': 'secrets',
+    'shm_size': 'shm_size',
+}
+
+# build options which can be translated into podman_image options
+BUILD_OPTIONS = ('context', 'dockerfile', 'args', 'target', 'cache_from',
+                 'no_cache', 'labels')
+BUILD_REGISTRY = 'localhost'  # where locally built images are stored
+
+DEFAULT_REGISTRY = 'docker.io'
+DEFAULT_LIBRARY = 'library'
+
+STATE_ACTION_MAP = {
+    'present': 'deploy',
+    'started': 'deploy',
+    'absent': 'destroy',
+}
+
+# merging compose files, the shell commands of services are replaced
+MERGE_REPLACE_KEYS = {'command', 'entrypoint', 'test'}
+# merging compose files, these lists of x=y entries are merged as mappings
+MERGE_MAPPING_KEYS = {'environment', 'labels', 'annotations', 'sysctls'}
+
+# the tokens of interpolated strings: $$, ${, $VAR or a closing brace
+INTERPOLATION_REGEX = re.compile(
+    r'\$(?:(\$)|(\{)|([A-Za-z_][A-Za-z0-9_]*))|(\})')
+# the variable name and optional operator following ${
+INTERPOLATION_NAME_REGEX = re.compile(r'([A-Za-z_][A-Za-z0-9_]*)(:?[-?+])?')
+# the Jinja2 expressions generated by the interpolation
+JINJA2_EXPRESSION_REGEX = re.compile(r'\{\{\s*(.*?)\s*\}\}')
+ENV_FACT_PREFIX = 'env_'  # prefix of the facts of hoisted variables
+# true if a variable is set, even empty, as Ansible replaces a default None
+# by an empty string, and a NUL character can't be part of a variable
+ENV_SET_TEST = "lookup('env', '{}', default='\\x00unset') != '\\x00unset'"
+# single quoted (literal) or double quoted (with escapes) values of .env files
+ENV_FILE_QUOTED_REGEX = re.compile(r"'([^']*)'|\"((?:[^\"\\]|\\.)*)\"")
+ENV_FILE_ESCAPE_REGEX = re.compile(r'\\(.)')
+ENV_FILE_ESCAPES = {'n': '\n', 't': '\t', 'r': '\r'}
+
+PODMAN_SOCKET = '/run/podman/podman.sock'
+
+KUBE_RESTART_MAP = {
+    'no': 'Never',
+    'on-failure': 'OnFailure',
+    'always': 'Always',
+    'unless-stopped': 'Always',
+}
+KUBE_PLAY_STATE_MAP = {
+    'present': 'started',
+    'absent': 'absent',
+}
+KUBE_VOLUME_SIZE = '1Gi'  # docker compose volumes have no size
+KUBE_NAME_LENGTH = 63  # maximum length of the names of pod volumes
+KUBE_YAML_WIDTH = 1 << 30  # avoid line breaks within Jinja2 expressions
+
+QUADLET_PATH = '/etc/containers/systemd'  # where to place quadlet units
+QUADLET_RESTART_MAP = {
+    'no': 'no',
+    'on-failure': 'on-failure',
+    'always': 'always',
+    'unless-stopped': 'always',
+}
+QUADLET_CONTAINER_MAP = {
+    'image': 'Image',
+    'hostname': 'HostName',
+    'shm_size': 'ShmSize',
+    'env_file': 'EnvironmentFile',
+}
+
+# the output kinds and the template used to render them
+KIND_TEMPLATE_MAP = {
+    'playbook': 'playbook',
+    'tasks': 'tasks',
+    'kube': 'playbook',
+    'quadlet': 'playbook',
+}
+
+# the templates are located next to this script
+TEMPLATES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              'templates')
+
+LINKED_NAME_MAX = 63  # maximum length of linked networks and pods names
+
+ASYNC_TIMEOUT = 3600  # maximum duration of an asynchronous task in seconds
+ASYNC_DELAY = 2  # delay in seconds between checks of asynchronous tasks
+
+BATCH_PATTERNS = ('*.yml', '*.yaml')  # files considered in batch directories
+
+CACHE_DIR = os.path.join(
+    os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')),
+    'doco2podans')
+J2_BYTECODE_DIR = os.path.join(CACHE_DIR, 'jinja2')  # compiled templates
+CACHE_SIZE = 100  # maximum size of the conversion cache in MiB
+WATCH_INTERVAL = 0.1  # seconds between two checks of the watched files
+
+# the options which have an influence on the result of a conversion
+CACHE_OPTIONS = ('kind', 'state', 'secret_exists', 'depends_network',
+                 'container_mode', 'pods', 'pre_pull', 'hoist_env',
+                 'resolve_env', 'env_files')
+# the options a client can pass to the conversion daemon
+SERVE_OPTIONS = CACHE_OPTIONS + ('cache',)
+
+# INTERMEDIATE REPRESENTATION #
+
+
+@dataclasses.dataclass(slots=True)
+class BuildSpec:
+    """
+    The options to build the image of a service
+    """
+    context: str = '.'
+    dockerfile: str = None
+    args: dict = None
+    target: str = None
+    cache_from: list = None
+    no_cache: bool = False
+    labels: dict = None
+    rest: dict = None  # unsupported build options
+
+
+@dataclasses.dataclass(slots=True)
+class Secret:
+    """
+    A secret and the file containing its data
+    """
+    name: str
+    file: str = None
+
+
+@dataclasses.dataclass(slots=True)
+class Network:
+    """
+    A network with its options
+    """
+    name: str
+    options: dict = dataclasses.field(default_factory=dict)
+    rest: dict = None  # unsupported network options
+
+
+@dataclasses.dataclass(slots=True)
+class Volume:
+    """
+    A volume with its options
+    """
+    name: str
+    options: dict = dataclasses.field(default_factory=dict)
+    rest: dict = None  # unsupported volume options
+
+
+@dataclasses.dataclass(slots=True)
+class Service:
+    """
+    A service, i.e. a container, with its options, the ones having the same
+    meaning for podman being already mapped to the podman options
+    """
+    name: str
+    options: dict = dataclasses.field(default_factory=dict)
+    build: BuildSpec = None
+    links: list = None
+    depends_on: list = None
+    environment: dict = None
+    env_files: list = None  # paths of env files and if they're required
+    labels: dict = None
+    configs: list = None
+    rest: dict = None  # unsupported container options
+
+
+@dataclasses.dataclass(slots=True)
+class Project:
+    """
+    A Docker Compose project with all its elements
+    """
+    name: str
+    services: dict = dataclasses.field(default_factory=dict)
+    networks: dict = dataclasses.field(default_factory=dict)
+    volumes: dict = dataclasses.field(default_factory=dict)
+    secrets: dict = dataclasses.field(default_factory=dict)
+    configs: dict = dataclasses.field(default_factory=dict)
+    envvars: 'EnvVars' = None
+
+
+@dataclasses.dataclass(slots=True)
+class EnvVars:
+    """
+    The environment variables referenced by a project, the facts holding
+    their values if they're hoisted, and the required ones, or the
+    environment to resolve them from at conversion time
+    """
+    hoist: bool = False
+    environment: dict = None  # resolve the variables if given
+    facts: dict = dataclasses.field(default_factory=dict)  # expression: fact
+    required: dict = dataclasses.field(default_factory=dict)  # (name, op): msg
+    unset: set = dataclasses.field(default_factory=set)  # resolved as empty
+    cache: dict = dataclasses.field(default_factory=dict)  # string: result
+
+
+@dataclasses.dataclass(slots=True)
+class Task:
+    """
+    An Ansible task, calling a module with its parameters or grouping tasks
+    as block, with additional task keywords (e.g. register or loop)
+    """
+    name: str
+    module: str = None
+    params: dict = dataclasses.field(default_factory=dict)
+    keywords: dict = dataclasses.field(default_factory=dict)
+    block: list = None
+
+    def to_dict(self):
+        """
+        Return the task as Ansible structure
+        """
+        task = {'name': self.name}
+        if self.block is not None:
+            task['block'] = [x.to_dict() for x in self.block]
+        else:
+            task[self.module] = self.params
+        task.update(self.keywords)
+        return task
+
+
+# INPUT #
+
+
+def read_doco_from_file(infile):
+    """
+    Read a Python structure from a Docker Compose file
+    """
+    content = yaml.load(infile, Loader=YAML_LOADER)
+    return content
+
+
+DOCO_FILES = {}  # modification time and structure of loaded files per path
+# modification time (None if missing) of the files read by the conversion
+READ_FILES = {}
+
+
+def resolve_doco(doco, args):
+    """
+    Resolve the includes and extends of the Docker Compose structure of the
+    project
+
+    Return the resolved structure and the resolver, which knows the files
+    """
+    resolver = DocoResolver(get_project_dir(args))
+    path = None
+    if not args.doco.name.startswith('<'):  # e.g. <stdin>
+        path = os.path.abspath(args.doco.name)
+    return resolver.resolve(doco, path), resolver
+
+
+def load_doco_file(path):
+    """
+    Load a Docker Compose file, only once per process as long as it isn't
+    modified, the structure returned being shared and not to be modified
+    """
+    path = os.path.abspath(path)
+    mtime = READ_FILES[path] = os.stat(path).st_mtime_ns
+    if path not in DOCO_FILES or DOCO_FILES[path][0] != mtime:
+        with open(path) as infile:
+            DOCO_FILES[path] = (mtime, read_doco_from_file(infile))
+    return DOCO_FILES[path][1]
+
+
+def file_exists(path):
+    """
+    Return True if the file exists, recording it as read by the conversion,
+    as its creation or removal changes the result
+    """
+    path = os.path.abspath(path)
+    try:
+        READ_FILES[path] = os.stat(path).st_mtime_ns
+    except OSError:
+        READ_FILES[path] = None
+    return READ_FILES[path] is not None
+
+
+def merge_doco(base, override, path=()):
+    """
+    Merge an override Docker Compose structure into a base one: mappings
+    are merged, sequences appended, scalars and shell commands replaced.
+    Untouched subtrees of both structures are shared, not copied.
+
+    Return the merged structure
+    """
+    if not isinstance(base, dict) or not isinstance(override, dict):
+        return override
+    merged = dict(base)
+    in_service = len(path) >= 2 and path[0] == 'services'
+    for key, value in override.items():
+        old = base.get(key)
+        if value is None:
+            continue  # nothing to override, e.g. an empty service
+        elif old is None:
+            merged[key] = value
+        elif in_service and key in MERGE_REPLACE_KEYS:
+            merged[key] = value
+        elif in_service and key in MERGE_MAPPING_KEYS:
+            merged[key] = {**extract_container_dict(old),
+                           **extract_container_dict(value)}
+        elif isinstance(old, dict) and isinstance(value, dict):
+            merged[key] = merge_doco(old, value, path + (key,))
+        elif isinstance(old, list) and isinstance(value, list):
+            merged[key] = merge_sequences(key, old, value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def merge_sequences(key, base, override):
+    """
+    Append the override sequence to the base one, skipping duplicates, the
+    volumes mounted on the same target being replaced
+    """
+    if key == 'volumes':
+        targets = {get_mount_target(x) for x in override}
+        return ([x for x in base if get_mount_target(x) not in targets]
+                + override)
+    return base + [x for x in override if x not in base]
+
+
+class ResolutionError(ValueError):
+    """
+    Raised if the includes or extends of a Docker Compose structure can't be
+    resolved, e.g. because of a cycle or of a missing service
+    """
+
+
+class DocoResolver:
+    """
+    Resolve the top-level include and the extends of the services of Docker
+    Compose structures, each file being loaded at most once per process and
+    resolved at most once per resolver, and each extended service being
+    resolved only once
+    """
+
+    def __init__(self, base_dir):
+        self.base_dir = base_dir  # the directory relative paths refer to
+        self.files = {}  # resolved structure per path
+        self.services = {}  # resolved service per path and service name
+        self.resolving = []  # files and services resolved, to find cycles
+
+    def resolve(self, doco, path=None):
+        """
+        Return the structure loaded from path (None if not from a file) with
+        its includes and extends resolved, sharing the untouched subtrees
+        """
+        if not isinstance(doco, dict):
+            return doco
+        services = doco.get('services') or {}
+        if 'include' not in doco and not any(
+                isinstance(x, dict) and 'extends' in x
+                for x in services.values()):
+            return doco
+        doco = dict(doco)
+        if 'include' in doco:
+            self.include(doco, doco.pop('include'), path)
+        services = doco.get('services') or {}
+        doco['services'] = {
+            x: self.resolve_service(path, x, services) for x in services}
+        return doco
+
+    def include(self, doco, includes, path):
+        """
+        Add to the structure the elements of the included files, which can't
+        redefine the existing elements
+        """
+        if not isinstance(includes, list):
+            includes = [includes]
+        for include in includes:
+            if isinstance(include, dict):
+                include = include['path']
+            if not isinstance(include, list):
+                include = [include]
+            included = self.load(self.get_path(path, include[0]))
+            for override in include[1:]:
+                included = merge_doco(
+                    included, self.load(self.get_path(path, override)))
+            for key in ('services', 'networks', 'volumes', 'secrets',
+                        'configs'):
+                elements = included.get(key) or {}
+                if not elements:
+                    continue
+                existing = doco.get(key) or {}
+                for name in elements:
+                    if name in existing:
+                        raise ResolutionError(
+                            '{} {} is defined by {} and an included file'
+                            .format(key, name, path or 'the project'))
+                doco[key] = {**existing, **elements}
+
+    def load(self, path):
+        """
+        Return the resolved structure of a file, detecting include cycles
+        """
+        if path not in self.files:
+            if path in self.resolving:
+                raise ResolutionError('include cycle through {}'.format(path))
+            self.resolving.append(path)
+            try:
+                self.files[path] = self.resolve(
+                    self.rebase(load_doco_file(path), path), path)
+            finally:
+                self.resolving.pop()
+        return self.files[path]
+
+    def resolve_service(self, path, name, services):
+        """
+        Return the service of the file at path with its extends chain
+        resolved, each service of the chain being resolved only once
+        """
+        key = (path, name)
+        if key in self.services:
+            return self.services[key]
+        if key in self.resolving:
+            raise ResolutionError('extends cycle through service {}'.format(
+                name))
+        if name not in services:
+            raise ResolutionError('extended service {} not found in {}'.format(
+                name, path or 'the project'))
+        service = services[name]
+        if not isinstance(service, dict) or 'extends' not in service:
+            self.services[key] = service
+            return service
+        extends = service['extends']
+        if isinstance(extends, str):
+            extends = {'service': extends}
+        base_path = path
+        base_services = services
+        if extends.get('file'):
+            base_path = self.get_path(path, extends['file'])
+            if base_path != path:
+                base_services = self.load(base_path).get('services') or {}
+        self.resolving.append(key)
+        try:
+            base = self.resolve_service(base_path, extends['service'],
+                                        base_services)
+        finally:
+            self.resolving.pop()
+        own = {x: y for x, y in service.items() if x != 'extends'}
+        self.services[key] = merge_doco(base or {}, own, ('services', name))
+        return self.services[key]
+
+    def get_path(self, path, relpath):
+        """
+        Return the absolute path of a file referenced from the file at path
+        """
+        base_dir = os.path.dirname(path) if path else self.base_dir
+        return os.path.abspath(os.path.join(base_dir, relpath))
+
+    def rebase(self, doco, path):
+        """
+        Return the structure of the file at path with the relative paths of
+        its services, secrets and configs rebased onto the base directory,
+        sharing the untouched subtrees
+        """
+        if (not isinstance(doco, dict)
+                or os.path.dirname(path) == self.base_dir):
+            return doco
+        doco = dict(doco)
+        if isinstance(doco.get('services'), dict):
+            doco['services'] = {x: self.rebase_service(y, path)
+                                for x, y in doco['services'].items()}
+        for key in ('secrets', 'configs'):
+            if not isinstance(doco.get(key), dict):
+                continue
+            doco[key] = {
+                x: dict(y, file=self.rebase_path(path, y['file']))
+                if isinstance(y, dict) and 'file' in y else y
+                for x, y in doco[key].items()}
+        return doco
+
+    def rebase_service(self, service, path):
+        """
+        Return the service with its env files, build context and bind mount
+        sources rebased from the file at path onto the base directory
+        """
+        if not isinstance(service, dict):
+            return service
+        service = dict(service)
+        env_files = service.get('env_file')
+        if isinstance(env_files, (str, dict)):
+            env_files = [env_files]
+        if env_files:
+            service['env_file'] = [
+                dict(x, path=self.rebase_path(path, x['path']))
+                if isinstance(x, dict) else self.rebase_path(path, x)
+                for x in env_files]
+        build = service.get('build')
+        if isinstance(build, str):
+            service['build'] = self.rebase_path(path, build)
+        elif isinstance(build, dict) and build.get('context'):
+            service['build'] = dict(
+                build, context=self.rebase_path(path, build['context']))
+        volumes = []
+        for volume in service.get('volumes') or []:
+            if isinstance(volume, str) and volume.startswith('.'):
+                source, sep, rest = volume.partition(':')
+                volume = self.rebase_path(path, source) + sep + rest
+            elif (isinstance(volume, dict) and volume.get('type') == 'bind'
+                    and str(volume.get('source', '')).startswith('.')):
+                volume = dict(
+                    volume, source=self.rebase_path(path, volume['source']))
+            volumes.append(volume)
+        if volumes:
+            service['volumes'] = volumes
+        return service
+
+    def rebase_path(self, path, relpath):
+        """
+        Return the path relative to the base directory of a path relative to
+        the file at path, unless absolute, in the home directory, a variable
+        or remote, e.g. a git repository
+        """
+        if (not isinstance(relpath, str) or relpath.startswith(('/', '~', '$'))
+                or ':' in relpath):
+            return relpath
+        relpath = os.path.relpath(self.get_path(path, relpath), self.base_dir)
+        if not relpath.startswith(os.pardir):  # still a relative host path
+            relpath = os.path.join(os.curdir, relpath)
+        return relpath
+
+
+def get_mount_target(volume):
+    """
+    Return the target path of a volume, in short or long syntax
+    """
+    if isinstance(volume, dict):
+        return volume.get('target')
+    parts = volume.split(':')
+    return parts[1] if len(parts) > 1 else parts[0]
+
+
+def parse_project(doco, args):
+    """
+    Parse a Docker Compose structure into a project, replacing environment
+    variables on the way
+
+    Return the project
+    """
+    envvars = EnvVars(hoist=args.hoist_env)
+    if args.resolve_env:
+        envvars.environment = get_environment(args)
+    with measure_stage(args, 'envvars'):
+        doco = recurse_replace_envvars(doco, envvars)
+    for name in sorted(envvars.unset):
+        args.diagnostics.add('warning', 'unset variable replaced by an '
+                             'empty string', detail=name)
+    project = Project(get_project_name(doco, args),
+                      configs=doco.get('configs') or {}, envvars=envvars)
+    for name, value in (doco.get('secrets') or {}).items():
+        project.secrets[name] = Secret(name, (value or {}).get('file'))
+    for name, value in (doco.get('networks') or {}).items():
+        same, rest = split_same_rest(value, NETWORK_SAME)
+        project.networks[name] = Network(name, same, rest)
+    for name, value in (doco.get('volumes') or {}).items():
+        same, rest = split_same_rest(value, VOLUME_SAME)
+        project.volumes[name] = Volume(name, same, rest)
+    for name, value in (doco.get('services') or {}).items():
+        project.services[name] = parse_service(name, value)
+    return project
+
+
+def parse_service(name, value):
+    """
+    Parse the options of a Docker Compose service
+
+    Return the service
+    """
+    same, rest = split_same_rest(value, CONTAINER_SAME)
+    rest = rest or {}
+    service = Service(name, same)
+    if 'build' in rest:
+        service.build = parse_build(rest.pop('build'))
+    if 'links' in rest:
+        service.links = [x.split(':')[0] for x in rest.pop('links')]
+    if 'environment' in rest:
+        service.environment = extract_container_dict(rest.pop('environment'))
+    if 'env_file' in rest:
+        service.env_files = parse_env_files(rest.pop('env_file'))
+    if 'labels' in rest:
+        service.labels = extract_container_dict(rest.pop('labels'))
+    if 'depends_on' in rest:
+        service.depends_on = list(rest.pop('depends_on'))
+    if 'configs' in rest:
+        service.configs = rest.pop('configs')
+    service.rest = rest
+    return service
+
+
+def parse_env_files(env_files):
+    """
+    Parse the env_file option of a service, a path or a list of paths or
+    of dictionaries with path and required keys
+
+    Return a list of tuples of path and required flag
+    """
+    if not isinstance(env_files, list):
+        env_files = [env_files]
+    parsed = []
+    for env_file in env_files:
+        if isinstance(env_file, dict):
+            parsed.append((env_file['path'], env_file.get('required', True)))
+        elif env_file:
+            parsed.append((env_file, True))
+    return parsed
+
+
+def parse_build(build):
+    """
+    Parse the build options of a service, either a context path or a
+    dictionary of options
+
+    Return the build specification
+    """
+    if isinstance(build, str):
+        return BuildSpec(context=build)
+    same, rest = split_same_rest(build, {x: x for x in BUILD_OPTIONS})
+    spec = BuildSpec(rest=rest, **same)
+    if spec.args is not None:
+        spec.args = extract_container_dict(spec.args)
+    if spec.labels is not None:
+        spec.labels = extract_container_dict(spec.labels)
+    return spec
+
+
+# TRANSFORM #
+
+
+def doco2podans(doco, args):
+    """
+    Transforms a Docker Compose structure into a Podman Ansible one
+    """
+    with measure_stage(args, 'parse'):
+        project = parse_project(doco, args)
+    tasks = []
+    with measure_stage(args, 'secrets'):
+        tasks += extract_secret_tasks(project, args)
+    with measure_stage(args, 'networks'):
+        tasks += extract_network_tasks(project, args)
+    with measure_stage(args, 'volumes'):
+        tasks += extract_volume_tasks(project, args)
+    with measure_stage(args, 'containers'):
+        tasks += extract_container_tasks(project, args)
+    if args.kind == 'kube':
+        with measure_stage(args, 'kube'):
+            tasks = create_kube_tasks(tasks, project, args)
+    elif args.kind == 'quadlet':
+        with measure_stage(args, 'quadlet'):
+            tasks = create_quadlet_tasks(tasks, project, args)
+    elif args.state == 'absent':
+        if args.container_mode == 'parallel':
+            with measure_stage(args, 'teardown'):
+                tasks = create_teardown_tasks(tasks)
+        else:
+            tasks.reverse()
+    # the environment variables are checked and set before anything else
+    tasks = create_envvar_tasks(project.envvars) + tasks
+    if args.statistics:
+        args.statistics.count_project(project)
+        args.statistics.count_tasks(tasks)
+    return tasks
+
+
+def create_envvar_tasks(envvars):
+    """
+    Create the tasks checking the required environment variables and
+    setting the facts of the hoisted ones, each one being looked up only
+    once for the whole play
+    """
+    tasks = []
+    for (name, operator), message in envvars.required.items():
+        if operator == ':?':
+            that = "lookup('env', '{}') | length > 0".format(name)
+        else:
+            that = ENV_SET_TEST.format(name)
+        tasks.append(Task(
+            'check environment variable {}'.format(name),
+            'ansible.builtin.assert', {'that': that, 'fail_msg': message}))
+    if envvars.facts:
+        tasks.append(Task(
+            'set environment variables', 'ansible.builtin.set_fact',
+            {y: '{{ ' + x + ' }}' for x, y in envvars.facts.items()}))
+    return tasks
+
+
+def create_teardown_tasks(tasks):
+    """
+    Re-order the tasks to destroy first the containers, wave by wave, as
+    they come, then all other elements in bulk, one looped task per kind
+
+    Return the teardown tasks
+    """
+    bulks = {}  # the module names as keys and the element names as values
+    for task in reversed(tasks):
+        if task.block is None:
+            bulks.setdefault(task.module, []).append(task.params['name'])
+    waves = [task for task in tasks if task.block is not None]
+    elements = {y: x for x, y in ANSMOD.items()}
+    for module, names in bulks.items():
+        waves.append(Task(
+            '{} {}s'.format(STATE_ACTION_MAP['absent'], elements[module]),
+            module,
+            {'name': '{{ item }}', 'state': 'absent'},
+            {'loop': names},
+        ))
+    return waves
+
+
+def extract_secret_tasks(project, args):
+    """
+    Extract secret Ansible tasks from a Docker Compose project
+    """
+    tasks = []
+    for name, secret in project.secrets.items():
+        task = get_stub_task(name, 'secret', args.state)
+        if args.state == 'absent':
+            tasks.append(task)
+            continue
+        task.params['data'] = \
+            "{{{{ lookup('file', '{}') }}}}".format(secret.file)
+        task.params[args.secret_exists] = True
+        tasks.append(task)
+
+    return tasks
+
+
+def extract_network_tasks(project, args):
+    """
+    Extract network Ansible tasks from a Docker Compose project
+    """
+    tasks = []
+    for name, network in project.networks.items():
+        task = get_stub_task(name, 'network', args.state)
+        if args.state == 'absent':
+            tasks.append(task)
+            continue
+        # transfer options which are the same ones
+        task.params.update(network.options)
+        for key in network.rest or ():
+            args.diagnostics.add('warning', 'unsupported network option',
+                                 key='networks.{}.{}'.format(name, key))
+        if network.rest:
+            task.params['rest'] = network.rest
+        tasks.append(task)
+    return tasks
+
+
+def extract_volume_tasks(project, args):
+    """
+    Extract volume Ansible tasks from a Docker Compose project
+    """
+    tasks = []
+    for name, volume in project.volumes.items():
+        task = get_stub_task(name, 'volume', args.state)
+        if args.state == 'absent':
+            tasks.append(task)
+            continue
+        # transfer options which are the same ones
+        task.params.update(volume.options)
+        for key in volume.rest or ():
+            args.diagnostics.add('warning', 'unsupported volume option',
+                                 key='volumes.{}.{}'.format(name, key))
+        if volume.rest:
+            task.params['rest'] = volume.rest
+        tasks.append(task)
+    return tasks
+
+
+def extract_container_tasks(project, args):
+    """
+    Extract container Ansible tasks from a Docker Compose project
+    """
+    if not project.services:
+        return []
+    tasks = []
+    hashed_tasks = {}
+    linked_containers = DisjointSet()
+    shared_volume_containers = set()
+    built_containers = set()
+    build_tasks = {}  # build tasks with their normalized build options as key
+    container_graph = collections.defaultdict(list)  # dependencies
+    for name, service in project.services.items():
+        task = get_stub_task(name, 'container', args.state)
+        task_module = task.params  # a kind of short link
+        # transfer options which are the same ones
+        task_module.update(service.options)
+        # we take care of the remaining options
+        if service.build:
+            if args.state == 'present':
+                for key in service.build.rest or ():
+                    args.diagnostics.add(
+                        'warning', 'unsupported build option', name,
+                        'services.{}.build.{}'.format(name, key))
+                create_build_task(service.build, name, task_module,
+                                  build_tasks)
+            built_containers.add(name)
+        elif 'image' in task_module:
+            improve_container_image(task_module)
+        elif args.state == 'present':  # FIXME should be an error...
+            args.diagnostics.add(
+                'warning', "either 'build' or 'image' must be defined",
+                name, 'services.{}'.format(name))
+        # keep trace of linked volumes
+        if 'volumes_from' in task_module:
+            shared_volume_containers |= set(task_module['volumes_from'])
+            container_graph[name].extend(task_module['volumes_from'])
+        # we keep together in networks containers which are somehow linked
+        if service.links is not None:
+            extract_container_links([name] + service.links,
+                                    linked_containers)
+        environment = service.environment
+        # kube manifests can't reference files, they're always inlined
+        if (service.env_files and args.env_files == 'reference'
+                and args.kind != 'kube'):
+            task_module['env_file'] = get_env_file_paths(service.env_files,
+                                                         args)
+        elif service.env_files:
+            # the environment has precedence over the env files
+            environment = {**get_env_files_variables(service.env_files, args),
+                           **(environment or {})}
+        if environment is not None:
+            task_module['env'] = environment
+        if service.labels is not None:
+            task_module['labels'] = service.labels
+        if service.depends_on is not None:
+            container_graph[name].extend(service.depends_on)
+            if args.depends_network:
+                extract_container_links([name] + service.depends_on,
+                                        linked_containers)
+        if service.configs is not None:
+            add_configs_to_volumes(task_module, service.configs,
+                                   project.configs)
+        # FIXME handle for now remaining options to not forget them
+        for key in service.rest or ():
+            args.diagnostics.add('warning', 'unsupported container option',
+                                 name, 'services.{}.{}'.format(name, key))
+        if service.rest:
+            task_module['rest'] = service.rest
+        # save the created container task in a dict and in our tasks list
+        hashed_tasks[name] = task
+    # handle the linked containers, either in a common network or pod
+    for network in linked_containers.components():
+        if args.pods:
+            network_task = create_linked_pod_task(network, hashed_tasks,
+                                                  args.state)
+        else:
+            network_task = create_linked_network_task(network, hashed_tasks,
+                                                      args.state)
+        tasks.insert(0, network_task)
+    # improve the volumes by adding SELinux labels
+    for name, task in hashed_tasks.items():
+        labels = True
+        if 'volumes' in task.params:
+            labels = improve_container_volume(name, task.params,
+                                              shared_volume_containers)
+        if not labels:
+            args.diagnostics.add(
+                'note', "don't forget to start the podman service!", name,
+                'services.{}.volumes'.format(name))
+            task.params['security_opt'] = task.params.get(
+                'security_opt', []) + ['label=disable']
+
+    # build all the images at once before starting any container
+    if build_tasks:
+        tasks.append(create_async_block(list(build_tasks.values()),
+                                        'build images', '__builds'))
+    # pull all the images at once before starting any container
+    if args.pre_pull and args.state == 'present':
+        pull_block = create_pull_block(hashed_tasks, built_containers)
+        if pull_block:
+            tasks.append(pull_block)
+
+    # Finally add the container tasks according to dependencies
+    if args.container_mode == 'batched':
+        generations = get_container_generations(hashed_tasks, container_graph)
+        for generation in generations:
+            tasks.append(create_batched_container_task(
+                generation, hashed_tasks, args.state))
+    elif args.container_mode == 'parallel':
+        if args.state == 'absent':
+            # containers without dependents can be removed first
+            generations = get_container_generations(
+                hashed_tasks, reverse_graph(container_graph))
+        else:
+            generations = get_container_generations(hashed_tasks,
+                                                    container_graph)
+        for idx, generation in enumerate(generations):
+            block_name = '{} containers {}'.format(
+                STATE_ACTION_MAP[args.state], ', '.join(generation))
+            tasks.append(create_async_block(
+                [hashed_tasks[x] for x in generation], block_name,
+                '__containers_{}'.format(idx)))
+    elif container_graph:
+        # we want to keep as much as possible the initial order hence we
+        # first add the containers without any dependencies
+        for task_name in hashed_tasks:
+            if task_name not in container_graph:
+                tasks.append(hashed_tasks[task_name])
+        # then we sort and add the containers with dependencies
+        import graphlib  # imported lazily, only needed with dependencies
+        topo_sorter = graphlib.TopologicalSorter(container_graph)
+        sorted_containers = tuple(topo_sorter.static_order())
+        for task_name in sorted_containers:
+            if task_name in container_graph:
+                tasks.append(hashed_tasks[task_name])
+    else:
+        for task_name in hashed_tasks:
+            tasks.append(hashed_tasks[task_name])
+
+    return tasks
+
+
+def get_container_generations(hashed_tasks, container_graph):
+    """
+    Group the containers into generations according to their dependencies,
+    each generation depending only on containers of previous generations.
+
+    Returns a list of lists of container names, keeping within each
+    generation the initial order of the containers.
+    """
+    import graphlib  # imported lazily, only needed with dependencies
+    order = {name: idx for idx, name in enumerate(hashed_tasks)}
+    topo_sorter = graphlib.TopologicalSorter(container_graph)
+    for task_name in hashed_tasks:
+        topo_sorter.add(task_name)
+    topo_sorter.prepare()
+    generations = []
+    while topo_sorter.is_active():
+        ready = topo_sorter.get_ready()
+        generation = sorted((x for x in ready if x in order), key=order.get)
+        if generation:
+            generations.append(generation)
+        topo_sorter.done(*ready)
+    return generations
+
+
+def reverse_graph(graph):
+    """
+    Reverse a dependency graph, the dependencies becoming the dependents
+
+    Returns the reversed graph as dictionary of lists
+    """
+    reversed_graph = collections.defaultdict(list)
+    for name, dependencies in graph.items():
+        for dependency in dependencies:
+            reversed_graph[dependency].append(name)
+    return reversed_graph
+
+
+def create_batched_container_task(generation, hashed_tasks, state):
+    """
+    Create one task handling all the containers of a generation at once.
+
+    Return the batched containers task.
+    """
+    task_name = '{} containers {}'.format(STATE_ACTION_MAP[state],
+                                          ', '.join(generation))
+    task = Task(task_name, ANSMOD['containers'], {
+        'containers': [hashed_tasks[x].params for x in generation],
+    })
+    return task
+
+
+def create_pull_block(hashed_tasks, built_containers):
+    """
+    Create a block pulling concurrently, and only once, each image used by
+    the containers, except the ones built locally
+
+    Return the pull block task or None if there is no image to pull
+    """
+    images = []
+    for name, task in hashed_tasks.items():
+        image = task.params.get('image')
+        if name not in built_containers and image and image not in images:
+            images.append(image)
+    if not images:
+        return None
+    pull_tasks = []
+    for image in images:
+        task = get_stub_task(image, 'image', 'present')
+        task.name = 'pull image {}'.format(image)
+        pull_tasks.append(task)
+    return create_async_block(pull_tasks, 'pull images', '__images')
+
+
+def create_async_block(tasks, block_name, register_prefix):
+    """
+    Create a block running the given tasks concurrently, i.e. starting them
+    asynchronously, and waiting for all of them to be finished.
+
+    The tasks are modified in place.
+    Return the block task.
+    """
+    registers = []
+    for idx, task in enumerate(tasks):
+        register = '{}_{}'.format(register_prefix, idx)
+        task.keywords['async'] = ASYNC_TIMEOUT
+        task.keywords['poll'] = 0
+        task.keywords['register'] = register
+        registers.append(register)
+    wait_task = Task(
+        'wait for {}'.format(block_name),
+        'ansible.builtin.async_status',
+        {'jid': '{{ item.ansible_job_id }}'},
+        {
+            'loop': '{{{{ [{}] }}}}'.format(', '.join(registers)),
+            'loop_control': {
+                'label': '{{ item.ansible_job_id }}',
+            },
+            'register': '__async_job',
+            'until': '__async_job.finished',
+            'retries': ASYNC_TIMEOUT // ASYNC_DELAY,
+            'delay': ASYNC_DELAY,
+        },
+    )
+    block = Task(block_name, block=tasks + [wait_task])
+    return block
+
+
+def split_same_rest(dictionary, same_map):
+    """
+    Split a dictionary between keys in the same_map and keys which aren't.
+
+    Returns both same (with mapped keys) and rest dictionaries.
+    """
+    if dictionary is None:
+        return {}, None
+    same = {same_map[x]: y for x, y in dictionary.items() if x in same_map}
+    rest = {x: y for x, y in dictionary.items() if x not in same_map}
+    return same, rest
+
+
+def create_build_task(build, container_name, task_module, build_tasks):
+    """
+    Create a container image build task and link it to the container task.
+
+    If an identical build task of the same image name, if any, already
+    exists in build_tasks, it is re-used and the container is linked to its
+    image, else the new build task is added to build_tasks.
+    """
+    context = build.context
+    extra_args = []
+    for key, value in (build.args or {}).items():
+        if value is None:  # the value is taken from the environment
+            extra_args.append('--build-arg={}'.format(key))
+        else:
+            extra_args.append('--build-arg={}={}'.format(key, value))
+    for key, value in (build.labels or {}).items():
+        extra_args.append('--label={}={}'.format(key, value))
+    if build.target:
+        extra_args.append('--target={}'.format(build.target))
+    for cache in build.cache_from or []:
+        extra_args.append('--cache-from={}'.format(cache))
+    build_module = {}
+    if build.dockerfile:
+        # the dockerfile is relative to the context for docker compose
+        build_module['file'] = os.path.join(context, build.dockerfile)
+    if build.no_cache:
+        build_module['cache'] = False
+    if extra_args:
+        build_module['extra_args'] = ' '.join(
+            quote_shell_arg(x) for x in extra_args)
+    # identical builds only need to happen once, unless the images are named
+    build_key = repr((context, sorted(build_module.items()),
+                      task_module.get('image')))
+    if build_key in build_tasks:
+        task_module['image'] = build_tasks[build_key].params['name']
+        return
+    image = task_module.get('image', '/'.join((BUILD_REGISTRY,
+                                               container_name)))
+    build_task = get_stub_task(image, 'image', 'present')
+    build_task.name = 'build image for container {}'.format(container_name)
+    build_task.params['path'] = context
+    if build_module:
+        build_task.params['build'] = build_module
+    task_module['image'] = image
+    build_tasks[build_key] = build_task
+
+
+def quote_shell_arg(arg):
+    """
+    Quote an argument for the shell, the Jinja2 expressions it contains
+    being quoted by Ansible once templated
+    """
+    parts = JINJA2_EXPRESSION_REGEX.split(arg)
+    if len(parts) == 1:
+        return shlex.quote(arg)
+    quoted = []
+    for idx, part in enumerate(parts):
+        if idx % 2:
+            quoted.append('{{ (' + part + ') | quote }}')
+        elif part:
+            quoted.append(shlex.quote(part))
+    return ''.join(quoted)
+
+
+def improve_container_image(task_module):
+    """
+    Prefix plain image name with a default registry path
+    """
+    count = task_module['image'].count('/')
+    if count == 0:
+        task_module['image'] = '/'.join(
+            (DEFAULT_REGISTRY, DEFAULT_LIBRARY, task_module['image']))
+    elif count == 1:
+        task_module['image'] = '/'.join(
+            (DEFAULT_REGISTRY, task_module['image']))
+
+
+def extract_container_dict(settings):
+    """
+    Return a potential list of x=y settings into a dictionary,
+    or the dictionary itself
+    """
+    if isinstance(settings, dict):
+        return settings
+    else:
+        return dict([x.split('=', maxsplit=1) for x in settings])
+
+
+def extract_container_links(links, linked_containers):
+    """
+    Extract the containers belonging into the same network and save them into
+    the linked_containers disjoint-set, merging the networks containing
+    the same container
+    """
+    linked_containers.find(links[0])  # a container can be linked to none
+    for container in links[1:]:
+        linked_containers.union(links[0], container)
+
+
+class DisjointSet:
+    """
+    A disjoint-set (aka union-find) structure, with path compression and
+    union by rank, to cluster efficiently items linked together
+    """
+
+    def __init__(self):
+        self.parents = {}
+        self.ranks = {}
+
+    def find(self, item):
+        """
+        Return the representative item of the set containing the item,
+        adding the item as its own set if it's yet unknown
+        """
+        if item not in self.parents:
+            self.parents[item] = item
+            self.ranks[item] = 0
+            return item
+        root = item
+        while self.parents[root] != root:
+            root = self.parents[root]
+        # compress the path so that all items point directly to the root
+        while self.parents[item] != root:
+            self.parents[item], item = root, self.parents[item]
+        return root
+
+    def union(self, item, other):
+        """
+        Merge the sets containing both items
+        """
+        root = self.find(item)
+        other_root = self.find(other)
+        if root == other_root:
+            return
+        if self.ranks[root] < self.ranks[other_root]:
+            root, other_root = other_root, root
+        self.parents[other_root] = root
+        if self.ranks[root] == self.ranks[other_root]:
+            self.ranks[root] += 1
+
+    def components(self):
+        """
+        Return the list of sets, in the order the items have been added
+        """
+        components = {}
+        for item in self.parents:
+            components.setdefault(self.find(item), set()).add(item)
+        return list(components.values())
+
+
+def get_linked_name(prefix, containers):
+    """
+    Return a name made of the prefix and of the sorted names of the linked
+    containers, shortened with a hash if it becomes too long
+    """
+    name = prefix + "-".join(sorted(containers))
+    if len(name) > LINKED_NAME_MAX:
+        import hashlib  # imported lazily, only needed for long names
+        digest = hashlib.sha256(name.encode()).hexdigest()[:12]
+        name = name[:LINKED_NAME_MAX - len(digest) - 1] + "-" + digest
+    return name
+
+
+def create_linked_network_task(network, hashed_tasks, state):
+    """
+    Create a network task and link it to the container tasks linked together,
+    as given by one component of the linked containers.
+
+    Return the network task.
+    """
+    network_name = get_linked_name("nw-", network)
+    network_task = get_stub_task(network_name, 'network', state)
+    for container in network:
+        # FIXME do we need to handle multiple networks?
+        # FIXME would it be an alternative to use container:<name>
+        hashed_tasks[container].params['network'] = network_name
+    return network_task
+
+
+def create_linked_pod_task(pod, hashed_tasks, state):
+    """
+    Create a pod task and place into it the containers linked together,
+    the ports of the containers being published by the pod.
+
+    Return the pod task.
+    """
+    pod_name = get_linked_name("pod-", pod)
+    pod_task = get_stub_task(pod_name, 'pod', state)
+    ports = []
+    for container in sorted(pod):
+        task_module = hashed_tasks[container].params
+        task_module['pod'] = pod_name
+        # containers in a pod can't publish ports, only the pod itself
+        if 'ports' in task_module:
+            ports += task_module.pop('ports')
+    if ports and state != 'absent':
+        pod_task.params['publish'] = ports
+    return pod_task
+
+
+def improve_container_volume(name, task_module, shared_volume_containers):
+    """
+    Add where necessary a shared or individual SELinux label to volumes,
+    and potentially replace docker.sock with podman.sock
+
+    In this case, return false to show that labels must be disabled
+    """
+    labels = True
+    if name in shared_volume_containers:
+        label = 'z'  # shared SELinux label
+    else:
+        label = 'Z'  # individual SELinux label
+    volumes = []  # the volumes of the service aren't modified in place
+    for vol in task_module['volumes']:
+        vols = vol.split(':')
+        if vols[0] == '/var/run/docker.sock':
+            vols[0] = PODMAN_SOCKET
+            labels = False
+        if len(vols) < 3:
+            vol = ":".join(vols + [label])
+        else:
+            opts = vols[-1].split(',')
+            if 'z' not in opts and 'Z' not in opts:
+                vol = ":".join(vols[:-1] + [','.join(opts + [label])])
+            else:
+                vol = ":".join(vols)
+        volumes.append(vol)
+    task_module['volumes'] = volumes
+    return labels
+
+
+def get_stub_task(name, element, state):
+    """
+    Return a task with task name, Ansible podman module, element name and state
+    """
+    task_name = '{} {} {}'.format(STATE_ACTION_MAP[state], element, name)
+    task = Task(task_name, ANSMOD[element], {'name': name})
+    # the 'present' state is the default state
+    if state != 'present':
+        task.params['state'] = state
+    return task
+
+
+def add_configs_to_volumes(task_module, task_configs, configs):
+    # the volumes of the service aren't modified in place
+    task_module['volumes'] = list(task_module.get('volumes', []))
+    for config in task_configs:
+        if isinstance(config, dict):
+            source = configs[config['source']]['file']
+            target = config.get('target', '/' + config['source'])
+        else:
+            source = configs[config]['file']
+            target = '/' + config
+        # configs are always potentially shared, hence (small) z
+        task_module['volumes'].append(':'.join((source, target, 'z')))
+
+
+def create_kube_tasks(tasks, project, args):
+    """
+    Translate the tasks into Kubernetes manifests, a pod with all containers,
+    persistent volume claims and secrets, played by one single task.
+
+    Return the image build tasks followed by the podman_play task.
+    """
+    kube_tasks = []
+    containers = []
+    volumes = []
+    secrets = []
+    for task in tasks:
+        if task.block and any(x.module == ANSMOD['image']
+                              for x in task.block):
+            kube_tasks.append(task)  # images must be built beforehand
+            continue
+        containers += get_task_modules([task], 'container')
+        volumes += get_task_modules([task], 'volume')
+        secrets += get_task_modules([task], 'secret')
+    pod_name = project.name
+    manifests = []
+    for secret in secrets:
+        manifests.append(create_kube_secret(project.secrets[secret['name']]))
+    for volume in volumes:
+        manifests.append(create_kube_volume_claim(volume))
+    manifests.append(create_kube_pod(pod_name, containers,
+                                     get_project_dir(args)))
+    play_task = Task(
+        '{} kube pod {}'.format(STATE_ACTION_MAP[args.state], pod_name),
+        ANSMOD['play'],
+        {
+            'kube_file_content': LiteralString(yaml.dump_all(
+                manifests, Dumper=KubeDumper, sort_keys=False,
+                width=KUBE_YAML_WIDTH)),
+            'state': KUBE_PLAY_STATE_MAP[args.state],
+        },
+    )
+    kube_tasks.append(play_task)
+    return kube_tasks
+
+
+class KubeDumper(YAML_DUMPER):
+    """
+    A YAML dumper keeping the Jinja2 expressions of the manifests intact
+    once the manifests are themselves embedded in a task
+    """
+
+    def represent_str(self, data):
+        if '{{' in data:  # single quotes would be doubled and break Jinja2
+            return self.represent_scalar('tag:yaml.org,2002:str', data,
+                                         style='"')
+        return super().represent_str(data)
+
+
+KubeDumper.add_representer(str, KubeDumper.represent_str)
+
+
+def get_task_modules(tasks, element):
+    """
+    Return the module parameters of all tasks of the given element,
+    looking as well into blocks and batched tasks
+    """
+    modules = []
+    for task in tasks:
+        if task.block is not None:
+            modules += get_task_modules(task.block, element)
+        elif task.module == ANSMOD[element]:
+            modules.append(task.params)
+        elif element == 'container' and task.module == ANSMOD['containers']:
+            modules += task.params['containers']
+    return modules
+
+
+def get_project_dir(args):
+    """
+    Return the project directory, the directory of the Docker Compose file
+    or the current directory if read from stdin
+    """
+    if args.doco.name.startswith('<'):  # e.g. <stdin>
+        return os.getcwd()
+    return os.path.dirname(os.path.abspath(args.doco.name))
+
+
+def get_project_name(doco, args):
+    """
+    Return the project name, either as defined in the Docker Compose file
+    or as the name of the directory of the Docker Compose file
+    """
+    name = doco.get('name')
+    if not name:
+        if args.doco.name.startswith('<'):  # e.g. <stdin>
+            name = 'doco2podans'
+        else:
+            name = os.path.basename(
+                os.path.dirname(os.path.abspath(args.doco.name)))
+    return re.sub(r'[^a-z0-9-]+', '-', name.lower()).strip('-')
+
+
+def create_kube_secret(secret):
+    """
+    Return a Kubernetes secret manifest out of a secret
+    """
+    data = "{{{{ lookup('file', '{}') | b64encode }}}}".format(secret.file)
+    manifest = {
+        'apiVersion': 'v1',
+        'kind': 'Secret',
+        'metadata': {'name': secret.name},
+        'data': {secret.name: data},
+    }
+    return manifest
+
+
+def create_kube_volume_claim(volume):
+    """
+    Return a Kubernetes persistent volume claim out of a volume task module
+    """
+    manifest = {
+        'apiVersion': 'v1',
+        'kind': 'PersistentVolumeClaim',
+        'metadata': {'name': volume['name']},
+        'spec': {
+            'accessModes': ['ReadWriteOnce'],
+            'resources': {'requests': {'storage': KUBE_VOLUME_SIZE}},
+        },
+    }
+    return manifest
+
+
+def create_kube_pod(pod_name, containers, project_dir):
+    """
+    Return a Kubernetes pod manifest out of container task modules, relative
+    host paths being made absolute from the project directory
+    """
+    kube_containers = {}
+    kube_volumes = {}
+    pod_spec = {'containers': []}
+    for container in containers:
+        kube_container = {
+            'name': container['name'],
+            'image': container.get('image'),
+        }
+        if 'command' in container:
+            command = container['command']
+            if isinstance(command, str):
+                command = shlex.split(command)
+            kube_container['args'] = command
+        if 'env' in container:
+            kube_container['env'] = [
+                {'name': x, 'value': '' if y is None else str(y)}
+                for x, y in container['env'].items()]
+        if 'ports' in container:
+            kube_container['ports'] = [
+                parse_kube_port(x) for x in container['ports']]
+        mounts = []
+        for volume in container.get('volumes', []):
+            mounts.append(parse_kube_volume(volume, kube_volumes,
+                                            project_dir))
+        for secret in container.get('secrets', []):
+            secret_name = secret['source'] if isinstance(secret, dict) \
+                else secret
+            volume_name = 'secret-' + secret_name
+            kube_volumes[volume_name] = {
+                'name': volume_name,
+                'secret': {'secretName': secret_name},
+            }
+            mounts.append({
+                'name': volume_name,
+                'mountPath': '/run/secrets/' + secret_name,
+                'subPath': secret_name,
+                'readOnly': True,
+            })
+        if mounts:
+            kube_container['volumeMounts'] = mounts
+        if 'hostname' in container:
+            pod_spec['hostname'] = container['hostname']
+        if 'restart_policy' in container:
+            pod_spec['restartPolicy'] = KUBE_RESTART_MAP.get(
+                container['restart_policy'], 'Always')
+        kube_containers[container['name']] = kube_container
+        pod_spec['containers'].append(kube_container)
+    # all containers of the pod can share the volumes of other containers
+    for container in containers:
+        for other in container.get('volumes_from', []):
+            other_mounts = kube_containers[other.split(':')[0]].get(
+                'volumeMounts', [])
+            kube_containers[container['name']].setdefault(
+                'volumeMounts', []).extend(dict(x) for x in other_mounts)
+    if kube_volumes:
+        pod_spec['volumes'] = list(kube_volumes.values())
+    manifest = {
+        'apiVersion': 'v1',
+        'kind': 'Pod',
+        'metadata': {'name': pod_name},
+        'spec': pod_spec,
+    }
+    return manifest
+
+
+def parse_kube_port(port):
+    """
+    Return a Kubernetes container port out of a Docker Compose port,
+    in short (e.g. [ip:]host:container[/protocol]) or long syntax
+    """
+    if isinstance(port, dict):
+        kube_port = {'containerPort': int(port['target'])}
+        if 'published' in port:
+            kube_port['hostPort'] = int(port['published'])
+        if 'host_ip' in port:
+            kube_port['hostIP'] = port['host_ip']
+        if 'protocol' in port:
+            kube_port['protocol'] = port['protocol'].upper()
+        return kube_port
+    port, _, protocol = str(port).partition('/')
+    ports = port.rsplit(':', maxsplit=2)
+    kube_port = {'containerPort': int(ports[-1])}
+    if len(ports) > 1 and ports[-2]:
+        kube_port['hostPort'] = int(ports[-2])
+    if len(ports) > 2 and ports[0]:
+        kube_port['hostIP'] = ports[0]
+    if protocol:
+        kube_port['protocol'] = protocol.upper()
+    return kube_port
+
+
+def parse_kube_volume(volume, kube_volumes, project_dir):
+    """
+    Return a Kubernetes volume mount out of a container volume, adding the
+    corresponding pod volume to kube_volumes if not yet present, relative
+    host paths being made absolute from the project directory, as required
+    by Kubernetes.
+    """
+    vols = volume.split(':')
+    if len(vols) == 1 or not vols[1].startswith('/'):
+        # anonymous volume, only followed by options if any
+        source, target, options = None, vols[0], vols[1:]
+    else:
+        source, target, options = vols[0], vols[1], vols[2:]
+    options = options[0].split(',') if options else []
+    if source is None:
+        volume_name = 'anonymous-{}'.format(sum(
+            'emptyDir' in x for x in kube_volumes.values()))
+        pod_volume = {'name': volume_name, 'emptyDir': {}}
+    elif source.startswith(('/', '.', '~')):
+        import hashlib  # imported lazily, only needed for host paths
+        # the hash keeps apart paths with the same slug, e.g. a_b and a-b
+        slug = re.sub(r'[^a-z0-9-]+', '-', source.lower()).strip('-')
+        volume_name = '{}-{}'.format(
+            slug[:KUBE_NAME_LENGTH - 9] or 'host',
+            hashlib.sha256(source.encode()).hexdigest()[:8])
+        if source.startswith('.'):
+            source = os.path.normpath(os.path.join(project_dir, source))
+        pod_volume = {'name': volume_name, 'hostPath': {'path': source}}
+    else:
+        volume_name = source
+        pod_volume = {'name': volume_name,
+                      'persistentVolumeClaim': {'claimName': source}}
+    kube_volumes.setdefault(volume_name, pod_volume)
+    mount = {'name': volume_name, 'mountPath': target}
+    if 'ro' in options:
+        mount['readOnly'] = True
+    return mount
+
+
+def create_quadlet_tasks(tasks, project, args):
+    """
+    Translate the tasks into Quadlet units, installed and started at once,
+    so that systemd starts the containers in parallel, also at boot time.
+
+    Return the secret and image tasks, and the tasks handling the units.
+    """
+    kept_tasks = []
+    units = []
+    for task in tasks:
+        if task.module == ANSMOD['secret'] or (
+                task.block and any(x.module == ANSMOD['image']
+                                   for x in task.block)):
+            kept_tasks.append(task)  # quadlet handles neither
+            continue
+        for network in get_task_modules([task], 'network'):
+            units.append(create_quadlet_unit(
+                network['name'], 'network',
+                {'Network': {'NetworkName': network['name']}}))
+        for volume in get_task_modules([task], 'volume'):
+            units.append(create_quadlet_unit(
+                volume['name'], 'volume',
+                {'Volume': {'VolumeName': volume['name']}}))
+        for pod in get_task_modules([task], 'pod'):
+            pod_section = {'PodName': pod['name']}
+            if 'publish' in pod:
+                pod_section['PublishPort'] = [str(x) for x in pod['publish']]
+            units.append(create_quadlet_unit(pod['name'], 'pod',
+                                             {'Pod': pod_section}))
+        for container in get_task_modules([task], 'container'):
+            service = project.services[container['name']]
+            dependencies = (service.depends_on or []) + [
+                x.split(':')[0]
+                for x in service.options.get('volumes_from', [])]
+            units.append(create_quadlet_container_unit(
+                container, dependencies, get_project_dir(args)))
+    unit_files = ['{}/{}'.format(QUADLET_PATH, x['name']) for x in units]
+    services = [x['name'].replace('.container', '.service') for x in units
+                if x['name'].endswith('.container')]
+    reload_task = Task('reload systemd units',
+                       'ansible.builtin.systemd_service',
+                       {'daemon_reload': True})
+    if args.state == 'absent':
+        stop_tasks = []
+        if services:
+            stop_tasks.append(Task(
+                'stop container services', 'ansible.builtin.command',
+                {'cmd': 'systemctl stop ' + ' '.join(services)},
+                {
+                    'register': '__stop_services',
+                    # 5 = unknown unit
+                    'failed_when': "__stop_services.rc not in [0, 5]",
+                },
+            ))
+        remove_task = Task(
+            'remove quadlet units', 'ansible.builtin.file',
+            {'path': '{{ item }}', 'state': 'absent'},
+            {'loop': unit_files},
+        )
+        # volumes and networks aren't removed with their units
+        for task in tasks:
+            if task.module in (ANSMOD['network'], ANSMOD['volume'],
+                               ANSMOD['pod']):
+                kept_tasks.insert(0, task)
+        return stop_tasks + [remove_task, reload_task] + kept_tasks
+    install_task = Task(
+        'install quadlet units', 'ansible.builtin.copy',
+        {
+            'dest': QUADLET_PATH + '/{{ item.name }}',
+            'content': '{{ item.content }}',
+            'mode': '0644',
+        },
+        {
+            'loop': units,
+            'loop_control': {'label': '{{ item.name }}'},
+        },
+    )
+    start_tasks = []
+    if services:
+        # one systemctl call lets systemd start all services in parallel
+        start_tasks.append(Task(
+            'start container services', 'ansible.builtin.command',
+            {'cmd': 'systemctl start ' + ' '.join(services)},
+            {'changed_when': False},
+        ))
+    return kept_tasks + [install_task, reload_task] + start_tasks
+
+
+def create_quadlet_container_unit(container, dependencies, project_dir):
+    """
+    Return a Quadlet container unit out of a container task module and
+    the names of the containers it depends on, relative host paths being
+    made absolute from the project directory
+    """
+    unit = {}
+    dependencies = ['{}.service'.format(x) for x in dependencies]
+    if dependencies:
+        unit['Unit'] = {
+            'Requires': ' '.join(dependencies),
+            'After': ' '.join(dependencies),
+        }
+    section = {'ContainerName': container['name']}
+    for key, value in container.items():
+        if key in QUADLET_CONTAINER_MAP:
+            section[QUADLET_CONTAINER_MAP[key]] = value
+    if 'command' in container:
+        command = container['command']
+        if not isinstance(command, str):
+            command = shlex.join(command)
+        section['Exec'] = command
+    if 'env' in container:
+        section['Environment'] = ['{}={}'.format(x, '' if y is None else y)
+                                  for x, y in container['env'].items()]
+    if 'labels' in container:
+        section['Label'] = ['{}={}'.format(x, y)
+                            for x, y in container['labels'].items()]
+    if 'ports' in container:
+        section['PublishPort'] = [str(x) for x in container['ports']]
+    volumes = []
+    for volume in container.get('volumes', []):
+        vols = volume.split(':')
+        if vols[0].startswith('.'):  # relative to the unit file else
+            vols[0] = os.path.normpath(os.path.join(project_dir, vols[0]))
+        elif not vols[0].startswith(('/', '~')):
+            vols[0] += '.volume'  # named volume with a unit
+        volumes.append(':'.join(vols))
+    if volumes:
+        section['Volume'] = volumes
+    podman_args = []
+    for option in container.get('security_opt', []):
+        if option == 'label=disable':
+            section['SecurityLabelDisable'] = 'true'
+        elif option in ('no-new-privileges', 'no-new-privileges:true'):
+            section['NoNewPrivileges'] = 'true'
+        else:
+            podman_args.append('--security-opt=' + option)
+    if 'network' in container:
+        section['Network'] = container['network'] + '.network'
+    if 'pod' in container:
+        section['Pod'] = container['pod'] + '.pod'
+    if 'secrets' in container:
+        section['Secret'] = [x['source'] if isinstance(x, dict) else x
+                             for x in container['secrets']]
+    podman_args += ['--volumes-from=' + x
+                    for x in container.get('volumes_from', [])]
+    if podman_args:
+        section['PodmanArgs'] = podman_args
+    unit['Container'] = section
+    if 'restart_policy' in container:
+        unit['Service'] = {'Restart': QUADLET_RESTART_MAP.get(
+            container['restart_policy'], 'always')}
+    unit['Install'] = {'WantedBy': 'multi-user.target default.target'}
+    return create_quadlet_unit(container['name'], 'container', unit)
+
+
+def create_quadlet_unit(name, element, sections):
+    """
+    Create a Quadlet unit from a dictionary of sections, each section being
+    a dictionary of keys with a value or a list of values.
+
+    Return a dictionary with the file name and content of the unit.
+    """
+    sections = dict(sections)
+    sections.setdefault('Unit', {})
+    sections['Unit'] = dict(
+        {'Description': '{} {} generated by doco2podans'.format(
+            element, name)},
+        **sections['Unit'])
+    lines = []
+    for section in ('Unit', element.capitalize(), 'Service', 'Install'):
+        if section not in sections:
+            continue
+        if lines:
+            lines.append('')
+        lines.append('[{}]'.format(section))
+        for key, values in sections[section].items():
+            if not isinstance(values, list):
+                values = [values]
+            for value in values:
+                # percent signs are specifiers for systemd
+                value = str(value).replace('%', '%%')
+                if key in ('Environment', 'Label') and (
+                        ' ' in value or '"' in value):
+                    value = '"{}"'.format(value.replace('\\', '\\\\')
+                                          .replace('"', '\\"'))
+                lines.append('{}={}'.format(key, value))
+    unit = {
+        'name': '{}.{}'.format(name, element),
+        'content': LiteralString('\n'.join(lines) + '\n'),
+    }
+    return unit
+
+
+# OUTPUT #
+
+
+class LiteralString(str):
+    """
+    A string to be output as literal block in YAML
+    """
+
+
+def yaml_literal_representer(dumper, data):
+    """
+    Represents a LiteralString as literal block in YAML
+    """
+    # libyaml only accepts genuine strings
+    return dumper.represent_scalar('tag:yaml.org,2002:str', str(data),
+                                   style='|')
+
+
+for dumper in {yaml.SafeDumper, YAML_DUMPER}:
+    yaml.add_representer(LiteralString, yaml_literal_representer,
+                         Dumper=dumper)
+
+
+def j2_filter_to_yaml(value, **params):
+    """
+    Implements a to_yaml filter for Jinja2 templates
+    """
+    return yaml.dump(value, Dumper=YAML_DUMPER, **params)
+
+
+J2_ENVIRONMENTS = {}  # one Jinja2 environment per templates path
+
+
+def get_jinja2_environment(path=TEMPLATES_PATH):
+    """
+    Get a Jinja2 environment from the templates directory, created only once
+    per process and path, so that templates are compiled only once, and
+    their bytecode is cached across processes if possible
+    """
+    if path in J2_ENVIRONMENTS:
+        return J2_ENVIRONMENTS[path]
+    import jinja2  # imported lazily, not needed if the result is cached
+    try:
+        os.makedirs(J2_BYTECODE_DIR, exist_ok=True)
+        bytecode_cache = jinja2.FileSystemBytecodeCache(J2_BYTECODE_DIR)
+    except OSError:
+        bytecode_cache = None
+    j2_env = jinja2.Environment(
+        loader=jinja2.FileSystemLoader(path),
+        autoescape=jinja2.select_autoescape(),
+        bytecode_cache=bytecode_cache,
+    )
+    j2_env.filters['to_yaml'] = j2_filter_to_yaml
+    J2_ENVIRONMENTS[path] = j2_env
+    return j2_env
+
+
+def generate_from_template(tasks, path=TEMPLATES_PATH, kind='playbook'):
+    """
+    Generate a string from a list of Ansible tasks
+
+    path is the directory where to find the template of the kind given
+    """
+    outfile = io.StringIO()
+    stream_from_template(tasks, outfile, path, kind)
+    return outfile.getvalue()
+
+
+class TeeFile:
+    """
+    A file object writing into multiple file objects at once
+    """
+
+    def __init__(self, *outfiles):
+        self.outfiles = outfiles
+
+    def write(self, text):
+        for outfile in self.outfiles:
+            outfile.write(text)
+
+
+def stream_from_template(tasks, outfile, path=TEMPLATES_PATH,
+                         kind='playbook'):
+    """
+    Write a list of Ansible tasks into a file object
+
+    Only the header is rendered from the template of the kind given, found
+    in the path directory, each task is then dumped and written one by one,
+    indented by the tasks_indent defined in the template, so that the whole
+    text never needs to be held in memory
+    """
+    j2_env = get_jinja2_environment(path)
+    j2_template = j2_env.get_template(
+        '{kind}.yml.j2'.format(kind=KIND_TEMPLATE_MAP[kind]))
+    header = j2_template.make_module({'tasks': None})
+    outfile.write(str(header))
+
+    prefix = ' ' * getattr(header, 'tasks_indent', 0)
+    if not tasks:
+        outfile.write(prefix + '[]\n')
+    for task in tasks:
+        text = yaml.dump([task.to_dict()], Dumper=YAML_DUMPER,
+                         sort_keys=False)
+        if prefix:  # like Jinja's indent filter, blank lines aren't indented
+            text = ''.join(line if line == '\n' else prefix + line
+                           for line in text.splitlines(keepends=True))
+        outfile.write(text)
+
+
+def parse_arguments(argv=None):
+    """
+    Parse arguments from argv, by default sys.argv
+
+    Returns the parsed arguments
+    """
+    parser = argparse.ArgumentParser(
+        description="Translate Docker Compose to Podman Ansible")
+    parser.add_argument('--kind', default='playbook',
+                        choices=['playbook', 'tasks', 'kube', 'quadlet'],
+                        help='kind of Ansible file to create')
+    parser.add_argument('--state', default='present',
+                        choices=['present', 'absent'],
+                        help='deploy or destroy')
+    parser.add_argument('--secret-exists', default='skip_existing',
+                        choices=['skip_existing', 'force'],
+                        help='how to handle existing secrets, '
+                        'leave as is or force replacement')
+    parser.add_argument('--depends-network',
+                        action=argparse.BooleanOptionalAction,
+                        help='create network out of dependencies')
+    parser.add_argument('--container-mode', default='serial',
+                        choices=['serial', 'batched', 'parallel'],
+                        help='one task per container, one task per '
+                        'generation of containers without inter-dependencies, '
+                        'or one asynchronous task per container of a '
+                        'generation run concurrently')
+    parser.add_argument('--pods', action=argparse.BooleanOptionalAction,
+                        help='place linked containers in a common pod '
+                        'instead of a common network')
+    parser.add_argument('--pre-pull', action=argparse.BooleanOptionalAction,
+                        help='pull concurrently all images before starting '
+                        'any container')
+    parser.add_argument('--resolve-env',
+                        action=argparse.BooleanOptionalAction,
+                        help='resolve the environment variables at '
+                        'conversion time from the environment and the .env '
+                        'file of the project directory')
+    parser.add_argument('--env-files', default='inline',
+                        choices=['inline', 'reference'],
+                        help='merge the variables of the env files of the '
+                        'services into their environment, or reference the '
+                        'files in the container tasks')
+    parser.add_argument('--hoist-env', action=argparse.BooleanOptionalAction,
+                        help='look up each environment variable only once, '
+                        'into a fact set at the start of the play')
+    parser.add_argument('--batch', metavar='OUTDIR',
+                        help='convert all docker compose files found in the '
+                        'sources, directories or glob patterns, into the '
+                        'output directory, mirroring their tree')
+    parser.add_argument('--jobs', type=int,
+                        help='number of parallel conversions in batch mode, '
+                        'by default the number of processors')
+    parser.add_argument('--watch', action='store_true',
+                        help='convert again the source into the target each '
+                        'time the source, the files it references or the '
+                        'templates change')
+    parser.add_argument('--cache', default=True,
+                        action=argparse.BooleanOptionalAction,
+                        help='re-use the result of previous conversions of '
+                        'the same content with the same options')
+    parser.add_argument('--cache-dir', default=CACHE_DIR,
+                        help='directory of the conversion cache')
+    parser.add_argument('--cache-size', type=int, default=CACHE_SIZE,
+                        help='maximum size of the conversion cache in MiB')
+    parser.add_argument('--serve', metavar='SOCKET',
+                        help='run as conversion daemon listening on the '
+                        'Unix socket')
+    parser.add_argument('--client', metavar='SOCKET',
+                        help='let the conversion daemon listening on the '
+                        'Unix socket convert the source')
+    parser.add_argument('--stats', choices=['table', 'json'],
+                        help='write to stderr the duration and memory '
+                        'allocations of each stage of the conversion, and '
+                        'counts of the converted elements, as table or JSON')
+    parser.add_argument('--profile', metavar='FILE',
+                        help='write the profile of the conversion into the '
+                        'file, to be analyzed with pstats')
+    parser.add_argument('--diagnostics-format', default='text',
+                        choices=['text', 'json'],
+                        help='write the warnings and notes to stderr as text '
+                        'or JSON lines')
+    parser.add_argument('-f', '--file', action='append', dest='files',
+                        metavar='FILE',
+                        help='a docker compose file, repeated to override '
+                        'the previous ones, the path being then only the '
+                        'target')
+    parser.add_argument('paths', nargs='*', metavar='path',
+                        help='a source docker compose file and a target '
+                        'Ansible file (default stdout), or the sources in '
+                        'batch mode')
+    parsed_args = parser.parse_args(argv)
+    parsed_args.overrides = []
+    if parsed_args.files:
+        if parsed_args.serve or parsed_args.batch:
+            parser.error('-f can only be used for a single conversion')
+        elif len(parsed_args.paths) > 1:
+            parser.error('only the target can be given with -f')
+        parsed_args.paths[:0] = parsed_args.files[:1]
+        parsed_args.overrides = parsed_args.files[1:]
+    if ((parsed_args.stats or parsed_args.profile)
+            and (parsed_args.serve or parsed_args.batch or parsed_args.watch
+                 or parsed_args.client)):
+        parser.error('--stats and --profile only apply to a single local '
+                     'conversion')
+    parsed_args.statistics = Statistics() if parsed_args.stats else None
+    # replaced by the environment of the client in daemon mode
+    parsed_args.environment = dict(os.environ)
+    parsed_args.diagnostics = Diagnostics(
+        None if parsed_args.batch or not parsed_args.paths
+        else parsed_args.paths[0])
+    if parsed_args.serve:
+        parsed_args.doco = parsed_args.podans = None
+    elif not parsed_args.paths:
+        parser.error('the source is required, except in serve mode')
+    elif parsed_args.batch:
+        parsed_args.doco = parsed_args.podans = None
+    elif len(parsed_args.paths) > 2:
+        parser.error('only one source and one target can be given, '
+                     'except in batch mode')
+    elif parsed_args.watch and len(parsed_args.paths) != 2:
+        parser.error('a source and a target file are required in watch mode')
+    else:
+        parsed_args.doco = argparse.FileType('r')(parsed_args.paths[0])
+        if parsed_args.watch:
+            parsed_args.podans = None  # the target is written atomically
+        elif len(parsed_args.paths) > 1:
+            parsed_args.podans = argparse.FileType('w')(parsed_args.paths[1])
+        else:
+            parsed_args.podans = sys.stdout
+    return parsed_args
+
+
+# INTERPOLATION #
+
+
+class InterpolationError(ValueError):
+    """
+    Raised if a string can't be interpolated, because of an invalid format
+    or of a missing required variable
+    """
+
+
+@dataclasses.dataclass(slots=True)
+class Variable:
+    """
+    A variable within an interpolated string, with its operator and the
+    parts of its argument, i.e. default value, error message or replacement
+    """
+    name: str
+    operator: str = None
+    argument: list = None
+
+
+def recurse_replace_envvars(struct, envvars=None):
+    """
+    Replace environment variables of the form $XXX or ${ENV} recursively,
+    with compose-style defaults and errors, collecting them into envvars
+
+    Returns the structure with replaced environment variables
+    """
+    if envvars is None:
+        envvars = EnvVars()
+    if isinstance(struct, list):
+        return [recurse_replace_envvars(x, envvars) for x in struct]
+    elif isinstance(struct, dict):
+        return {x: recurse_replace_envvars(y, envvars)
+                for x, y in struct.items()}
+    elif isinstance(struct, str):
+        return interpolate(struct, envvars)
+    else:
+        return struct
+
+
+def interpolate(string, envvars):
+    """
+    Interpolate the environment variables of a string, either resolving
+    them or replacing them with Jinja2 expressions, identical strings being
+    interpolated only once
+
+    Return the interpolated string
+    """
+    if '$' not in string:
+        return string
+    result = envvars.cache.get(string)
+    if result is None:
+        parts = parse_interpolation(string)[0]
+        if envvars.environment is None:
+            result = render_parts(parts, envvars, envvars.hoist)
+        else:
+            result = resolve_parts(parts, envvars)
+        envvars.cache[string] = result
+    return result
+
+
+def parse_interpolation(string, start=0, nested=False):
+    """
+    Parse a string, from start up to its end, or up to the closing brace if
+    nested within ${...}, into parts, literal strings and variables
+
+    Return the parts and the index following the parsed characters
+    """
+    parts = []
+    literal = ''
+    idx = start
+    while True:
+        match = INTERPOLATION_REGEX.search(string, idx)
+        if match is None:
+            if nested:
+                raise InterpolationError(
+                    'missing closing brace in {!r}'.format(string))
+            literal += string[idx:]
+            break
+        literal += string[idx:match.start()]
+        idx = match.end()
+        escaped, braced, name, closing = match.groups()
+        if closing:
+            if nested:
+                break
+            literal += closing
+            continue
+        elif escaped:
+            literal += escaped
+            continue
+        elif braced:
+            match = INTERPOLATION_NAME_REGEX.match(string, idx)
+            if match is None:
+                raise InterpolationError(
+                    'invalid interpolation format in {!r}'.format(string))
+            name, operator = match.groups()
+            argument = None
+            if operator:
+                argument, idx = parse_interpolation(string, match.end(), True)
+            elif string.startswith('}', match.end()):
+                idx = match.end() + 1
+            else:
+                raise InterpolationError(
+                    'invalid interpolation format in {!r}'.format(string))
+            variable = Variable(name, operator, argument)
+        else:
+            variable = Variable(name)
+        if literal:
+            parts.append(literal)
+            literal = ''
+        parts.append(variable)
+    if literal:
+        parts.append(literal)
+    return parts, idx
+
+
+def render_parts(parts, envvars, hoist=False):
+    """
+    Render parts as string for Ansible, the variables becoming Jinja2
+    expressions, or references to the facts they're hoisted into
+    """
+    strings = []
+    for part in parts:
+        if isinstance(part, str):
+            strings.append(part)
+            continue
+        expression = get_variable_expression(part, envvars)
+        if hoist:
+            expression = get_envvar_fact(expression, part.name, envvars)
+        strings.append('{{ ' + expression + ' }}')
+    return ''.join(strings)
+
+
+def get_envvar_fact(expression, name, envvars):
+    """
+    Return the name of the fact holding the value of the expression,
+    defining a new one if needed
+    """
+    if expression not in envvars.facts:
+        facts = set(envvars.facts.values())
+        fact = ENV_FACT_PREFIX + name
+        idx = 1
+        while fact in facts:  # the same variable with another default
+            idx += 1
+            fact = '{}{}_{}'.format(ENV_FACT_PREFIX, name, idx)
+        envvars.facts[expression] = fact
+    return envvars.facts[expression]
+
+
+def get_variable_expression(variable, envvars):
+    """
+    Return the Jinja2 expression looking up a variable, with compose-style
+    default (operators - and :-) or replacement (+ and :+) values, the
+    required variables (? and :?) being collected into envvars
+    """
+    name, operator = variable.name, variable.operator
+    lookup = "lookup('env', '{}')".format(name)
+    if operator is None:
+        return lookup
+    elif operator.endswith('?'):
+        envvars.required.setdefault(
+            (name, operator), render_parts(variable.argument, envvars)
+            or 'required variable {} is missing a value'.format(name))
+        return lookup
+    argument = get_parts_expression(variable.argument, envvars)
+    if operator == ':-':
+        return '{} or {}'.format(lookup, argument)
+    elif operator == '-':
+        return "lookup('env', '{}', default={})".format(name, argument)
+    elif operator == ':+':
+        return "{} if {} else ''".format(argument, lookup)
+    else:  # +
+        return "{} if {} else ''".format(argument, ENV_SET_TEST.format(name))
+
+
+def get_parts_expression(parts, envvars):
+    """
+    Return the Jinja2 expression concatenating the parts
+    """
+    expressions = []
+    for part in parts:
+        if isinstance(part, str):
+            expressions.append(quote_jinja2_string(part))
+        else:
+            expressions.append(
+                '({})'.format(get_variable_expression(part, envvars)))
+    return ' ~ '.join(expressions) or "''"
+
+
+def get_environment(args):
+    """
+    Return the environment to resolve variables from, the environment of
+    the process, or of the client in daemon mode, having precedence over
+    the .env file of the project
+    """
+    environment = {}
+    dotenv_path = os.path.join(get_project_dir(args), '.env')
+    if os.path.isfile(dotenv_path):
+        environment.update(get_env_file(dotenv_path))
+    environment.update(args.environment)
+    return environment
+
+
+def get_env_file_paths(env_files, args):
+    """
+    Return the absolute paths of the env files of a service to be
+    referenced by the container, skipping the missing optional ones
+    """
+    project_dir = get_project_dir(args)
+    paths = [(os.path.join(project_dir, x), y) for x, y in env_files]
+    return [x for x, y in paths if y or file_exists(x)]
+
+
+def get_env_files_variables(env_files, args):
+    """
+    Return the variables of the env files of a service, the later files
+    having precedence, missing optional files being skipped
+    """
+    project_dir = get_project_dir(args)
+    variables = {}
+    for path, required in env_files:
+        path = os.path.join(project_dir, path)
+        if required or file_exists(path):
+            variables.update(get_env_file(path))
+    return variables
+
+
+ENV_FILES = {}  # modification time and variables of env files per path
+
+
+def get_env_file(path):
+    """
+    Return the variables of an environment file, read only once per process
+    as long as it isn't modified, e.g. across services and batched files
+    """
+    path = os.path.abspath(path)
+    mtime = READ_FILES[path] = os.stat(path).st_mtime_ns
+    if path not in ENV_FILES or ENV_FILES[path][0] != mtime:
+        ENV_FILES[path] = (mtime, read_env_file(path))
+    return ENV_FILES[path][1]
+
+
+def read_env_file(path):
+    """
+    Read an environment file made of VAR=VALUE lines, with comments, and
+    single (literal) or double (with escapes) quoted values
+
+    Return a dictionary of the variables
+    """
+    environment = {}
+    with open(path) as env_file:
+        for line in env_file:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if line.startswith('export '):
+                line = line[len('export '):].lstrip()
+            name, sep, value = line.partition('=')
+            name = name.strip()
+            if not sep:
+                continue  # a variable without value is taken from the shell
+            value = value.strip()
+            quoted = ENV_FILE_QUOTED_REGEX.match(value)
+            if quoted and quoted[1] is not None:
+                value = quoted[1]
+            elif quoted:
+                value = ENV_FILE_ESCAPE_REGEX.sub(
+                    lambda x: ENV_FILE_ESCAPES.get(x[1], x[1]), quoted[2])
+            else:
+                value = value.split(' #')[0].rstrip()
+            environment[name] = value
+    return environment
+
+
+def quote_jinja2_string(string):
+    """
+    Return the string as single quoted Jinja2 string literal
+    """
+    return "'{}'".format(string.replace('\\', '\\\\').replace("'", "\\'"))
+
+
+def resolve_parts(parts, envvars):
+    """
+    Resolve the variables of the parts from the environment of envvars,
+    collecting the unset variables replaced by an empty string
+
+    Return the resolved string
+    """
+    strings = []
+    for part in parts:
+        if isinstance(part, str):
+            strings.append(part)
+            continue
+        name, operator = part.name, part.operator
+        value = envvars.environment.get(name)
+        if operator and operator.startswith(':'):
+            is_set = bool(value)
+        else:
+            is_set = value is not None
+        if operator in (':-', '-'):
+            if not is_set:
+                value = resolve_parts(part.argument, envvars)
+        elif operator in (':+', '+'):
+            value = resolve_parts(part.argument, envvars) if is_set else ''
+        elif operator in (':?', '?'):
+            if not is_set:
+                raise InterpolationError('{}: {}'.format(
+                    name, resolve_parts(part.argument, envvars)
+                    or 'required variable is missing a value'))
+        elif value is None:
+            envvars.unset.add(name)
+            value = ''
+        strings.append(value)
+    return ''.join(strings)
+
+
+# CACHE #
+
+
+TEMPLATES_DIGESTS = {}  # digest of the templates per templates path
+
+
+def get_templates_digest(path=TEMPLATES_PATH):
+    """
+    Return a digest of the content of all templates, computed only once per
+    process and path
+    """
+    if path not in TEMPLATES_DIGESTS:
+        import hashlib  # imported lazily, only needed with the cache
+        digest = hashlib.sha256()
+        for name in sorted(os.listdir(path)):
+            digest.update(name.encode())
+            with open(os.path.join(path, name), 'rb') as template:
+                digest.update(template.read())
+        TEMPLATES_DIGESTS[path] = digest.hexdigest()
+    return TEMPLATES_DIGESTS[path]
+
+
+def get_cache_path(content, args):
+    """
+    Return the path of the cache entry for the content of a docker compose
+    file, keyed on the content, the options, the templates and the version,
+    the other files read during the conversion being checked on reading
+    """
+    import hashlib  # imported lazily, only needed with the cache
+    digest = hashlib.sha256()
+    digest.update(VERSION.encode())
+    # a modified but not yet versioned module mustn't re-use the cache
+    with open(__file__, 'rb') as script:
+        digest.update(script.read())
+    digest.update(get_templates_digest().encode())
+    for option in CACHE_OPTIONS:
+        digest.update('{}={!r}\n'.format(
+            option, getattr(args, option)).encode())
+    # the project name defaults to the name of the compose file's directory,
+    # which relative paths are made absolute from
+    digest.update(get_project_dir(args).encode())
+    digest.update(get_project_name({}, args).encode())
+    for path in args.overrides:
+        digest.update('{}={}\n'.format(
+            os.path.abspath(path), os.stat(path).st_mtime_ns).encode())
+    if args.resolve_env:
+        digest.update(repr(sorted(get_environment(args).items())).encode())
+    digest.update(content.encode())
+    return os.path.join(args.cache_dir, digest.hexdigest() + '.yml')
+
+
+def get_cache_records_path(cache_path):
+    """
+    Return the path of the diagnostics records and of the modification
+    times of the files read by the conversion, stored next to a cache entry
+    """
+    return os.path.splitext(cache_path)[0] + '.json'
+
+
+def read_cache(cache_path):
+    """
+    Return a tuple of the cached content, the records of its diagnostics and
+    the modification times of the files read by the conversion, or None if
+    not in the cache or if one of these files changed, marking the entry as
+    recently used
+    """
+    try:
+        with open(get_cache_records_path(cache_path)) as records_file:
+            records = json.load(records_file)
+        if get_mtimes(records['files']) != records['files']:
+            return None
+        with open(cache_path) as cache_file:
+            text = cache_file.read()
+        os.utime(cache_path)
+    except (OSError, ValueError, KeyError):
+        return None
+    return text, records['diagnostics'], records['files']
+
+
+@contextlib.contextmanager
+def open_cache_entry(cache_path, diagnostics, cache_size):
+    """
+    Open the cache entry to write the text into, written atomically along
+    with the records of the diagnostics and the modification times of the
+    files read by the conversion, and evict the least recently used entries
+    if the cache becomes bigger than the cache size in MiB
+    """
+    cache_dir = os.path.dirname(cache_path)
+    os.makedirs(cache_dir, exist_ok=True)
+    with open_file_atomically(cache_path) as cache_file:
+        yield cache_file
+        # the records first, as an entry is only found through its text
+        write_file_atomically(get_cache_records_path(cache_path), json.dumps(
+            {'diagnostics': diagnostics.records(), 'files': READ_FILES}))
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith('.yml'):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total_size = sum(x[1] for x in entries)
+    for mtime, size, path in sorted(entries):
+        if total_size <= cache_size * 1024 * 1024:
+            break
+        with contextlib.suppress(OSError):  # parallel eviction
+            os.remove(path)
+            os.remove(get_cache_records_path(path))
+        total_size -= size
+
+
+def write_file_atomically(path, text):
+    """
+    Write the text into a temporary file and rename it to the path, so
+    that readers never see a partially written file
+    """
+    with open_file_atomically(path) as outfile:
+        outfile.write(text)
+
+
+@contextlib.contextmanager
+def open_file_atomically(path):
+    """
+    Open a temporary file to write into, renamed to the path once closed,
+    or removed if writing failed
+    """
+    temp_path = '{}.{}.tmp'.format(path, os.getpid())
+    try:
+        with open(temp_path, 'w') as temp_file:
+            yield temp_file
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(temp_path)
+        raise
+    os.replace(temp_path, path)
+
+
+# STATS #
+
+
+class Statistics:
+    """
+    Collect the duration and memory allocations of the stages of a
+    conversion, and counts of the converted elements
+    """
+
+    def __init__(self):
+        self.stages = {}  # name: [depth, duration in s, peak memory in B]
+        self.counters = {}
+        self.stack = []  # memory and peak memory of the running stages
+        self.start = time.perf_counter()
+        import tracemalloc  # imported lazily, only needed for statistics
+        tracemalloc.start()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        Measure a stage of the conversion, possibly nested in another one
+        """
+        import tracemalloc
+        if self.stack:  # the peak of the outer stage is about to be reset
+            self.stack[-1][1] = max(self.stack[-1][1],
+                                    tracemalloc.get_traced_memory()[1])
+        self.stages.setdefault(name, [len(self.stack), 0, 0])
+        tracemalloc.reset_peak()
+        self.stack.append([tracemalloc.get_traced_memory()[0], 0])
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            memory, peak = self.stack.pop()
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            self.stages[name][1] += duration
+            self.stages[name][2] = max(self.stages[name][2], peak - memory)
+            if self.stack:
+                self.stack[-1][1] = max(self.stack[-1][1], peak)
+
+    def count_project(self, project):
+        """
+        Count the elements of the project and its unsupported options
+        """
+        self.counters['services'] = len(project.services)
+        self.counters['networks'] = len(project.networks)
+        self.counters['volumes'] = len(project.volumes)
+        self.counters['secrets'] = len(project.secrets)
+        unsupported = sum(
+            len(x.rest or {}) + len((x.build and x.build.rest) or {})
+            for x in project.services.values())
+        unsupported += sum(len(x.rest or {}) for x in
+                           (*project.networks.values(),
+                            *project.volumes.values()))
+        self.counters['unsupported options'] = unsupported
+
+    def count_tasks(self, tasks):
+        """
+        Count the generated tasks, including the ones within blocks
+        """
+        stack = list(tasks)
+        count = 0
+        while stack:
+            task = stack.pop()
+            count += 1
+            stack.extend(task.block or ())
+        self.counters['tasks'] = count
+
+    def report(self, outfile, output_format='table'):
+        """
+        Write the statistics into outfile, as table or as JSON
+        """
+        total = time.perf_counter() - self.start
+        if output_format == 'json':
+            json.dump({
+                'total': round(total * 1000, 3),
+                'stages': {x: {'time': round(y[1] * 1000, 3),
+                               'memory': y[2] // 1024}
+                           for x, y in self.stages.items()},
+                'counters': self.counters,
+            }, outfile)
+            outfile.write('\n')
+            return
+        outfile.write('{:24} {:>10} {:>10}\n'.format(
+            'stage', 'time (ms)', 'peak (KiB)'))
+        for name, (depth, duration, peak) in self.stages.items():
+            outfile.write('{:24} {:10.2f} {:10}\n'.format(
+                '  ' * depth + name, duration * 1000, peak // 1024))
+        outfile.write('{:24} {:10.2f}\n'.format('total', total * 1000))
+        for name, count in self.counters.items():
+            outfile.write('{:24} {:10}\n'.format(name, count))
+
+
+def measure_stage(args, name):
+    """
+    Return a context manager measuring a stage of the conversion if
+    statistics are collected, else doing nothing
+    """
+    if args.statistics:
+        return args.statistics.stage(name)
+    return contextlib.nullcontext()
+
+
+# DIAGNOSTICS #
+
+
+@dataclasses.dataclass(slots=True, frozen=True)
+class Diagnostic:
+    """
+    A diagnostic of the conversion of a docker compose file, of severity
+    error, warning or note, the category being a fixed message, the key
+    the path to the concerned element in the docker compose structure
+    """
+    severity: str
+    category: str
+    file: str = None
+    service: str = None
+    key: str = None
+    detail: str = None
+
+    def __str__(self):
+        return '{:9}{}'.format(self.severity.upper() + ':', ': '.join(
+            x for x in (self.file, self.key, self.category, self.detail)
+            if x is not None))
+
+
+class Diagnostics:
+    """
+    Collect the diagnostics of conversions in memory, deduplicated and
+    counted, to report them all at once
+    """
+
+    def __init__(self, path=None):
+        self.path = path  # the docker compose file being converted
+        self.counts = {}  # the number of occurrences of each diagnostic
+
+    def add(self, severity, category, service=None, key=None, detail=None):
+        """
+        Add a diagnostic about the docker compose file being converted
+        """
+        diagnostic = Diagnostic(severity, category, self.path, service, key,
+                                detail)
+        self.counts[diagnostic] = self.counts.get(diagnostic, 0) + 1
+
+    def has(self, severity):
+        """
+        Return True if a diagnostic of the given severity was added
+        """
+        return any(x.severity == severity for x in self.counts)
+
+    def records(self):
+        """
+        Return the diagnostics as list of dictionaries with their count,
+        e.g. to be transferred between processes
+        """
+        return [dict(dataclasses.asdict(x), count=y)
+                for x, y in self.counts.items()]
+
+    def merge(self, records):
+        """
+        Add diagnostics given as records
+        """
+        for record in records:
+            record = dict(record)
+            count = record.pop('count')
+            diagnostic = Diagnostic(**record)
+            self.counts[diagnostic] = self.counts.get(diagnostic, 0) + count
+
+    def report(self, outfile, output_format='text', summary=False):
+        """
+        Write the diagnostics sorted by file into outfile, as text lines,
+        followed by the counts per category if summary, or as JSON lines
+        """
+        diagnostics = sorted(self.counts.items(),
+                             key=lambda x: x[0].file or '')
+        if output_format == 'json':
+            for diagnostic, count in diagnostics:
+                outfile.write(json.dumps(
+                    dict(dataclasses.asdict(diagnostic), count=count)) + '\n')
+            return
+        for diagnostic, count in diagnostics:
+            if count > 1:
+                outfile.write('{} ({} times)\n'.format(diagnostic, count))
+            else:
+                outfile.write('{}\n'.format(diagnostic))
+        if summary:
+            categories = collections.Counter()
+            for diagnostic, count in diagnostics:
+                categories[diagnostic.severity, diagnostic.category] += count
+            for (severity, category), count in sorted(categories.items()):
+                outfile.write('{:9}{} x {}\n'.format(
+                    'SUMMARY:', count, category))
+
+
+# CONVERSION #
+
+
+class NotDockerComposeError(ValueError):
+    """
+    The content converted isn't a docker compose structure
+    """
+
+
+def convert_doco(content, args, strict=False, outfile=None):
+    """
+    Convert the content of a docker compose file into the text of the kind
+    requested, re-using the cached result if the content has already been
+    converted with the same options
+
+    If strict, raise NotDockerComposeError if the content doesn't look like
+    a docker compose structure.
+    Return the converted text, or write it into outfile if given and return
+    None, streaming it task by task, also into the cache, unless measured
+    """
+    READ_FILES.clear()
+    cache_path = None
+    if args.cache:
+        with measure_stage(args, 'cache'):
+            cache_path = get_cache_path(content, args)
+            cached = read_cache(cache_path)
+        if cached is not None:
+            text, records, files = cached
+            # the diagnostics are about the file being converted
+            args.diagnostics.merge(dict(x, file=args.diagnostics.path)
+                                   for x in records)
+            READ_FILES.update(files)
+            with measure_stage(args, 'write'):
+                return return_or_write(text, outfile)
+    with measure_stage(args, 'load'):
+        doco_struct = read_doco_from_file(content)
+        for path in args.overrides:
+            doco_struct = merge_doco(doco_struct, load_doco_file(path))
+    if strict and (not isinstance(doco_struct, dict)
+                   or ('services' not in doco_struct
+                       and 'include' not in doco_struct)):
+        raise NotDockerComposeError('not a docker compose file')
+    with measure_stage(args, 'resolve'):
+        doco_struct = resolve_doco(doco_struct, args)[0]
+    with measure_stage(args, 'transform'):
+        podans_struct = doco2podans(doco_struct, args)
+    if outfile and not args.statistics:
+        if not cache_path:
+            stream_from_template(podans_struct, outfile, kind=args.kind)
+            return None
+        with open_cache_entry(cache_path, args.diagnostics,
+                              args.cache_size) as cache_file:
+            stream_from_template(podans_struct, TeeFile(outfile, cache_file),
+                                 kind=args.kind)
+        return None
+    with measure_stage(args, 'render'):
+        text = generate_from_template(
+            tasks=podans_struct,
+            kind=args.kind,
+        )
+    if cache_path:
+        with measure_stage(args, 'cache'):
+            with open_cache_entry(cache_path, args.diagnostics,
+                                  args.cache_size) as cache_file:
+                cache_file.write(text)
+    with measure_stage(args, 'write'):
+        return return_or_write(text, outfile)
+
+
+def return_or_write(text, outfile=None):
+    """
+    Write the text into outfile and return None, or return the text if
+    there is no outfile
+    """
+    if outfile is None:
+        return text
+    outfile.write(text)
+    return None
+
+
+# BATCH #
+
+
+def find_batch_files(sources, outdir):
+    """
+    Find the docker compose files in the sources, directories or glob
+    patterns, and the corresponding target files in the output directory,
+    at the path of the source files relative to the current directory, or
+    relative to the parent of the source directory if outside
+
+    Return a list of tuples (source file, target file), each source file
+    only once
+    """
+    import fnmatch  # imported lazily, only needed in batch mode
+    import glob
+    files = []
+    for source in sources:
+        if os.path.isdir(source):
+            parent = os.path.dirname(os.path.abspath(source))
+            for root, dirs, names in os.walk(source):
+                dirs.sort()
+                for name in sorted(names):
+                    if any(fnmatch.fnmatch(name, x)
+                           for x in BATCH_PATTERNS):
+                        path = os.path.join(root, name)
+                        relpath = os.path.relpath(path)
+                        if relpath.startswith(os.pardir):
+                            relpath = os.path.relpath(
+                                os.path.abspath(path), parent)
+                        files.append((path, relpath))
+        else:
+            for path in sorted(glob.glob(source, recursive=True)):
+                relpath = os.path.relpath(path)
+                if relpath.startswith(os.pardir):
+                    relpath = os.path.basename(path)
+                files.append((path, relpath))
+    targets = {}
+    for path, relpath in files:
+        targets.setdefault(os.path.abspath(path),
+                           (path, os.path.join(outdir, relpath)))
+    return list(targets.values())
+
+
+def check_batch_targets(files, diagnostics):
+    """
+    Add an error to the diagnostics for each source file converted into the
+    same target file as a previous one
+
+    Return True if all target files are distinct
+    """
+    sources = {}
+    for source, target in files:
+        if target in sources:
+            file_diagnostics = Diagnostics(source)
+            file_diagnostics.add(
+                'error', 'duplicate target',
+                detail='{} is also the target of {}'.format(
+                    target, sources[target]))
+            diagnostics.merge(file_diagnostics.records())
+        else:
+            sources[target] = source
+    return not diagnostics.has('error')
+
+
+def init_batch_worker():
+    """
+    Initialize a batch worker process with its own Jinja2 environment
+    """
+    get_jinja2_environment()
+
+
+def convert_batch_file(source, target, args):
+    """
+    Convert one docker compose file into a target file, within a batch
+
+    Return a tuple of the source, the status (converted, skipped or failed)
+    and the records of the diagnostics
+    """
+    file_args = argparse.Namespace(**vars(args))
+    file_args.diagnostics = Diagnostics(source)
+    try:
+        with open(source) as infile:
+            file_args.doco = infile
+            podans_yaml = convert_doco(infile.read(), file_args, strict=True)
+        os.makedirs(os.path.dirname(target) or os.curdir, exist_ok=True)
+        with open(target, 'w') as outfile:
+            outfile.write(podans_yaml)
+    except NotDockerComposeError as exc:
+        file_args.diagnostics.add('note', 'skipped', detail=str(exc))
+        return (source, 'skipped', file_args.diagnostics.records())
+    except Exception as exc:
+        file_args.diagnostics.add('error', 'conversion failed',
+                                  detail='{}: {}'.format(
+                                      type(exc).__name__, exc))
+        return (source, 'failed', file_args.diagnostics.records())
+    return (source, 'converted', file_args.diagnostics.records())
+
+
+def convert_batch(args):
+    """
+    Convert in parallel all docker compose files found in the sources and
+    write their diagnostics and a summary to stderr
+
+    Return the exit code, 1 if any conversion failed, else 0
+    """
+    files = find_batch_files(args.paths, args.batch)
+    if not check_batch_targets(files, args.diagnostics):
+        args.diagnostics.report(sys.stderr, args.diagnostics_format)
+        return 1
+    results = collections.defaultdict(list)
+    import concurrent.futures  # imported lazily, only needed in batch mode
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=args.jobs,
+            initializer=init_batch_worker) as executor:
+        futures = [executor.submit(convert_batch_file, source, target, args)
+                   for source, target in files]
+        for future in concurrent.futures.as_completed(futures):
+            source, status, records = future.result()
+            if status == 'converted' and any(
+                    x['severity'] == 'warning' for x in records):
+                status = 'warned'
+            results[status].append(source)
+            args.diagnostics.merge(records)
+    args.diagnostics.report(sys.stderr, args.diagnostics_format,
+                            summary=True)
+    sys.stderr.write(
+        'SUMMARY: {} converted ({} with warnings), {} skipped, {} failed\n'
+        .format(len(results['converted']) + len(results['warned']),
+                len(results['warned']), len(results['skipped']),
+                len(results['failed'])))
+    return 1 if results['failed'] else 0
+
+
+# WATCH #
+
+
+def get_watched_files(content, doco_path, templates_path=TEMPLATES_PATH):
+    """
+    Return the files a conversion depends on: the docker compose file and
+    its .env file, the secret and config files it references, the files
+    read by the last conversion, e.g. included, extended or env files, and
+    the templates
+    """
+    files = [doco_path, os.path.join(os.path.dirname(doco_path), '.env')]
+    files += [os.path.join(templates_path, x)
+              for x in sorted(os.listdir(templates_path))]
+    files += list(READ_FILES)
+    try:
+        doco = read_doco_from_file(content)
+    except yaml.YAMLError:
+        return files  # the docker compose file needs to be fixed first
+    if not isinstance(doco, dict):
+        return files
+    base_dir = os.path.dirname(doco_path)
+    references = []
+    for key in ('secrets', 'configs'):
+        for value in (doco.get(key) or {}).values():
+            if isinstance(value, dict) and 'file' in value:
+                references.append(value['file'])
+    files += [os.path.join(base_dir, x) for x in references if x]
+    return files
+
+
+def get_mtimes(files):
+    """
+    Return a dictionary of the modification times of the files, None for
+    missing ones
+    """
+    mtimes = {}
+    for path in files:
+        try:
+            mtimes[path] = os.stat(path).st_mtime_ns
+        except OSError:
+            mtimes[path] = None
+    return mtimes
+
+
+def watch(args, target):
+    """
+    Convert the docker compose file into the target each time the docker
+    compose file, the files it references or the templates change,
+    the target being left untouched if its content doesn't change
+    """
+    doco_path = args.doco.name
+    args.doco.close()
+    files = [doco_path]
+    mtimes = {}
+    while True:
+        current_mtimes = get_mtimes(files)
+        if current_mtimes != mtimes:
+            TEMPLATES_DIGESTS.clear()  # the templates might have changed
+            try:
+                with open(doco_path) as infile:
+                    content = infile.read()
+                    args.doco = infile
+                    try:
+                        text = convert_doco(content, args)
+                    finally:  # also the files read before a failure
+                        files = get_watched_files(content, doco_path)
+                try:
+                    with open(target) as outfile:
+                        changed = outfile.read() != text
+                except OSError:
+                    changed = True
+                if changed:
+                    write_file_atomically(target, text)
+                    args.diagnostics.add('note', 'regenerated',
+                                         detail=target)
+            except Exception as exc:
+                args.diagnostics.add('error', 'conversion failed',
+                                     detail='{}: {}'.format(
+                                         type(exc).__name__, exc))
+            args.diagnostics.report(sys.stderr, args.diagnostics_format)
+            args.diagnostics.counts.clear()
+            # the times sampled before or while reading the files, so that
+            # files saved during the conversion trigger another one
+            mtimes = {**get_mtimes(files), **READ_FILES, **current_mtimes}
+            mtimes = {x: mtimes[x] for x in files}
+        time.sleep(WATCH_INTERVAL)
+
+
+# DAEMON #
+
+
+def handle_conversion_request(line, default_args):
+    """
+    Handle one conversion request, a JSON line with the content and path
+    of the docker compose file and the options
+
+    Return the reply, with the converted text and the diagnostics, or the
+    error
+    """
+    args = argparse.Namespace(**vars(default_args))
+    try:
+        request = json.loads(line)
+        for option, value in request.get('options', {}).items():
+            if option == 'cache':  # the client can only disable it
+                args.cache = args.cache and value
+            elif option in SERVE_OPTIONS:
+                setattr(args, option, value)
+        args.doco = io.StringIO(request['doco'])
+        args.doco.name = request.get('path', '<stdin>')
+        args.overrides = request.get('overrides', [])
+        args.environment = request.get('environment', args.environment)
+        args.diagnostics = Diagnostics(args.doco.name)
+        text = convert_doco(request['doco'], args)
+        reply = {'output': text,
+                 'diagnostics': args.diagnostics.records()}
+    except Exception as exc:
+        reply = {'error': '{}: {}'.format(type(exc).__name__, exc),
+                 'diagnostics': args.diagnostics.records()}
+    return reply
+
+
+def serve(args, socket_path):
+    """
+    Run the conversion daemon on the Unix socket until interrupted, each
+    request being handled in a forked process, sharing the already compiled
+    templates
+    """
+    import socketserver  # imported lazily, only needed in daemon mode
+
+    class ConversionServer(socketserver.ForkingMixIn,
+                           socketserver.UnixStreamServer):
+        pass
+
+    class ConversionHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            reply = handle_conversion_request(self.rfile.readline(), args)
+            self.wfile.write(json.dumps(reply).encode() + b'\n')
+
+    # compile the templates once, before the request processes are forked
+    j2_env = get_jinja2_environment()
+    for template in set(KIND_TEMPLATE_MAP.values()):
+        j2_env.get_template('{}.yml.j2'.format(template))
+    get_templates_digest()
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(socket_path)  # left over by a previous daemon
+    with ConversionServer(socket_path, ConversionHandler) as server:
+        try:
+            server.serve_forever()
+        finally:
+            os.remove(socket_path)
+
+
+def convert_by_daemon(args, socket_path):
+    """
+    Let the conversion daemon listening on the Unix socket convert the
+    docker compose file, adding its diagnostics to ours, and its error if
+    the conversion failed
+
+    Return the converted text, or None if the conversion failed
+    """
+    path = args.doco.name
+    if not path.startswith('<'):  # e.g. <stdin>
+        path = os.path.abspath(path)  # the daemon has its own working dir
+    request = {
+        'doco': args.doco.read(),
+        'path': path,
+        'overrides': [os.path.abspath(x) for x in args.overrides],
+        'options': {x: getattr(args, x) for x in SERVE_OPTIONS},
+    }
+    if args.resolve_env:  # variables are resolved from our environment
+        request['environment'] = args.environment
+    import socket  # imported lazily, only needed in client mode
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(socket_path)
+        with client.makefile('rwb') as stream:
+            stream.write(json.dumps(request).encode() + b'\n')
+            stream.flush()
+            reply = json.loads(stream.readline())
+    args.diagnostics.merge(reply['diagnostics'])
+    if 'error' in reply:
+        args.diagnostics.add('error', 'conversion failed',
+                             detail=reply['error'])
+        return None
+    return reply['output']
+
+
+# MAIN #
+
+
+def main(argv=None):
+    """
+    Run dc2pa.py with the arguments argv, by default sys.argv
+
+    Return the exit code
+    """
+    args = parse_arguments(argv)
+    if args.serve:
+        with contextlib.suppress(KeyboardInterrupt):
+            serve(args, args.serve)
+        return 0
+    if args.batch:
+        return convert_batch(args)
+    if args.watch:
+        with contextlib.suppress(KeyboardInterrupt):
+            watch(args, args.paths[1])
+        return 0
+    try:
+        if args.client:
+            text = convert_by_daemon(args, args.client)
+            if text is not None:
+                args.podans.write(text)
+        elif args.profile:
+            import cProfile  # imported lazily, only needed for profiling
+            with cProfile.Profile() as profile:
+                convert_doco(args.doco.read(), args, outfile=args.podans)
+            profile.dump_stats(args.profile)
+        else:
+            convert_doco(args.doco.read(), args, outfile=args.podans)
+    except (InterpolationError, ResolutionError) as exc:
+        # errors of the docker compose file, not of doco2podans
+        args.diagnostics.add('error', 'conversion failed',
+                             detail='{}: {}'.format(type(exc).__name__, exc))
+    finally:
+        args.diagnostics.report(sys.stderr, args.diagnostics_format)
+    if args.statistics:
+        args.statistics.report(sys.stderr, args.stats)
+    return 1 if args.diagnostics.has('error') else 0